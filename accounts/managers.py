@@ -21,6 +21,20 @@ class CustomUserManager(BaseUserManager):
         extra_fields.setdefault('is_superuser', False)
         return self._create_user(email, password, **extra_fields)
 
+    def bulk_create_users(self, emails, **extra_fields):
+        """
+        Create accounts without a usable password for ``emails`` with one
+        INSERT. Emails that already have an account are skipped.
+        """
+        extra_fields.setdefault('is_staff', False)
+        extra_fields.setdefault('is_superuser', False)
+        users = []
+        for email in emails:
+            user = self.model(email=self.normalize_email(email), **extra_fields)
+            user.set_unusable_password()
+            users.append(user)
+        return self.bulk_create(users, ignore_conflicts=True)
+
     def create_superuser(self, email=None, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', True)
         extra_fields.setdefault('is_superuser', True)
@@ -0,0 +1,104 @@
+import gzip
+import json
+import logging
+import os
+import zlib
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from chat.history import message_to_json
+from chat.models import ChatGroup, Message
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ROOT = Path(getattr(settings, 'CHAT_ARCHIVE_ROOT', settings.BASE_DIR / 'chat_archive'))
+RETENTION_DAYS = getattr(settings, 'CHAT_RETENTION_DAYS', 90)
+SEGMENT_SIZE = getattr(settings, 'CHAT_ARCHIVE_SEGMENT_SIZE', 10000)
+CHUNK_SIZE = 64 * 1024
+
+
+def segment_paths(chat_group_id):
+    """Archive segments of a chat group, oldest first."""
+    return sorted((ARCHIVE_ROOT / str(chat_group_id)).glob('*.jsonl.gz'))
+
+
+def read_segment(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as segment:
+        for line in segment:
+            yield json.loads(line)
+
+
+def write_segment(chat_group_id, messages):
+    """Write ``messages`` as the next gzip JSON lines segment of the group and return its path."""
+    directory = ARCHIVE_ROOT / str(chat_group_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    existing = segment_paths(chat_group_id)
+    number = int(existing[-1].name.split('.')[0]) + 1 if existing else 1
+    path = directory / f"{number:06d}.jsonl.gz"
+
+    # a segment only appears under its final name once it is complete
+    partial = path.with_suffix('.partial')
+    with gzip.open(partial, 'wt', encoding='utf-8') as segment:
+        for message in messages:
+            segment.write(json.dumps(message_to_json(message)) + '\n')
+        segment.flush()
+        os.fsync(segment.fileno())
+    os.replace(partial, path)
+    return path
+
+
+def archive_group(chat_group, days=None, now=None):
+    """
+    Move the group's messages older than its retention into archive
+    segments of up to ``SEGMENT_SIZE`` messages, and delete them from the
+    table. Returns how many messages were moved.
+    """
+    if days is None:
+        days = chat_group.retention_days or RETENTION_DAYS
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+
+    # rows are deleted after their segment is written, finish the job if that was interrupted
+    existing = segment_paths(chat_group.id)
+    if existing:
+        Message.objects.filter(id__in=[message['message_id'] for message in read_segment(existing[-1])]).delete()
+
+    moved = 0
+    old = Message.objects.filter(chat_group_id=chat_group.id, created_at__lt=cutoff)
+    while True:
+        batch = list(old.select_related('creator').order_by('created_at', 'id')[:SEGMENT_SIZE])
+        if not batch:
+            break
+        path = write_segment(chat_group.id, batch)
+        Message.objects.filter(id__in=[message.id for message in batch]).delete()
+        moved += len(batch)
+        logger.info(f"Archived {len(batch)} messages of chat group {chat_group.id} to {path}")
+    return moved
+
+
+def archive_messages(days=None, now=None):
+    """Apply retention to every chat group and return {chat group id: messages moved}."""
+    return {chat_group.id: archive_group(chat_group, days, now) for chat_group in ChatGroup.objects.all()}
+
+
+def export_chunks(chat_group_id):
+    """
+    The group's whole history as gzip JSON lines, oldest first, in chunks.
+    Archive segments are passed through as they are, gzip allows members to
+    be concatenated, and the rows still in the table follow as one more
+    member compressed on the fly. Memory use does not grow with the history.
+    """
+    for path in segment_paths(chat_group_id):
+        with open(path, 'rb') as segment:
+            while chunk := segment.read(CHUNK_SIZE):
+                yield chunk
+
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    messages = Message.objects.filter(chat_group_id=chat_group_id).select_related('creator').order_by('created_at', 'id')
+    for message in messages.iterator(chunk_size=2000):
+        chunk = compressor.compress((json.dumps(message_to_json(message)) + '\n').encode())
+        if chunk:
+            yield chunk
+    yield compressor.flush()
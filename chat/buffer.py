@@ -0,0 +1,189 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Max
+
+from chat.membership import room_course_id
+from chat.models import ChatGroup, IdBlock, Message
+from courses.analytics import count_messages
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_ids(name, model, size):
+    """Reserve ``size`` consecutive ids for ``model`` and return the first one."""
+    table = connection.ops.quote_name(IdBlock._meta.db_table)
+    for _ in range(2):
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                cursor.execute(f"UPDATE {table} SET next_id = next_id + %s WHERE name = %s RETURNING next_id",
+                               [size, name])
+                row = cursor.fetchone()
+            if row:
+                return row[0] - size
+        else:
+            with transaction.atomic():
+                block = IdBlock.objects.select_for_update().filter(name=name).first()
+                if block:
+                    IdBlock.objects.filter(pk=block.pk).update(next_id=block.next_id + size)
+                    return block.next_id
+
+        last = model.objects.aggregate(last=Max('id'))['last'] or 0
+        IdBlock.objects.bulk_create([IdBlock(name=name, next_id=last + 1)], ignore_conflicts=True)
+    raise RuntimeError(f"Could not reserve ids for {name}")
+
+
+class MessageBuffer:
+    """
+    Write-behind buffer for chat messages.
+
+    ``add`` gives a message its id and timestamp in memory, so it can be
+    broadcast straight away. A background thread writes pending messages
+    with one ``bulk_create`` once ``max_size`` are waiting or every
+    ``max_delay`` seconds, and again when the process exits. Messages of
+    users or rooms deleted in the meantime are dropped, and while the
+    database is down at most ``max_pending`` messages are kept.
+    """
+
+    def __init__(self, max_size=100, max_delay=0.5, block_size=1000, max_pending=10000):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.block_size = block_size
+        self.flushed = 0
+        self._pending = []
+        self._ids = iter(())
+        self._ids_left = 0
+        self._spare_block = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def pending(self):
+        """Number of messages broadcast but not written yet."""
+        return len(self._pending)
+
+    @property
+    def needs_ids(self):
+        """True when ``add`` would have to reserve ids from the database first."""
+        return self._ids_left == 0 and self._spare_block is None
+
+    def reserve(self):
+        block = reserve_ids('chat.message', Message, self.block_size)
+        with self._lock:
+            if self._spare_block is None:
+                self._spare_block = block
+                return
+        # another thread won the race, this block is simply left unused
+
+    def add(self, creator, chat_group, content):
+        """Queue an unsaved ``Message`` with its final id and return it."""
+        if self.needs_ids:
+            self.reserve()
+        with self._lock:
+            if self._ids_left == 0:
+                start, self._spare_block = self._spare_block, None
+                self._ids = iter(range(start, start + self.block_size))
+                self._ids_left = self.block_size
+            self._ids_left -= 1
+            message = Message(id=next(self._ids), creator=creator, chat_group=chat_group, content=content)
+            self._pending.append(message)
+            size = len(self._pending)
+
+        self._start()
+        if size >= self.max_size or self._spare_block is None and self._ids_left < self.block_size // 2:
+            self._wake.set()
+        return message
+
+    def pending_for(self, chat_group_id):
+        with self._lock:
+            return [message for message in self._pending if message.chat_group_id == chat_group_id]
+
+    def flush(self):
+        """Write every pending message now and return how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                try:
+                    self.write(batch)
+                except (IntegrityError, ValueError):
+                    # a creator or room deleted since the message was sent
+                    written = self.existing(batch)
+                    if len(written) < len(batch):
+                        logger.warning(f"Dropped {len(batch) - len(written)} chat messages of deleted users or rooms")
+                    batch = written
+                    self.write(batch)
+            except Exception:
+                logger.exception(f"Could not write {len(batch)} chat messages, retrying")
+                self.requeue(batch)
+                return 0
+            self.flushed += len(batch)
+            logger.debug(f"Wrote {len(batch)} chat messages")
+            try:
+                count_messages((room_course_id(message.chat_group.group_name), message.created_at)
+                               for message in batch)
+            except Exception:
+                # the messages are safe, only the course analytics miss them
+                logger.exception(f"Could not count {len(batch)} chat messages in the course analytics")
+            return len(batch)
+
+    @staticmethod
+    def write(batch):
+        with transaction.atomic():
+            Message.objects.bulk_create(batch)
+
+    @staticmethod
+    def existing(batch):
+        # deleting the instance itself clears its pk, so look at the related objects
+        creators = set(get_user_model().objects.filter(id__in={message.creator.pk for message in batch})
+                       .values_list('id', flat=True))
+        groups = set(ChatGroup.objects.filter(id__in={message.chat_group.pk for message in batch})
+                     .values_list('id', flat=True))
+        return [message for message in batch if message.creator.pk in creators and message.chat_group.pk in groups]
+
+    def requeue(self, batch):
+        """Put a failed batch back in front, dropping the oldest messages beyond ``max_pending``."""
+        with self._lock:
+            self._pending[:0] = batch
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                del self._pending[:overflow]
+        if overflow > 0:
+            logger.error(f"Chat write queue full, dropped the {overflow} oldest messages")
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='chat-flush', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                if self._spare_block is None:
+                    self.reserve()
+                self.flush()
+            except Exception:
+                logger.exception('Chat flush thread failed')
+            finally:
+                close_old_connections()
+
+
+message_buffer = MessageBuffer(max_size=getattr(settings, 'CHAT_FLUSH_SIZE', 100),
+                               max_delay=getattr(settings, 'CHAT_FLUSH_INTERVAL', 0.5),
+                               block_size=getattr(settings, 'CHAT_ID_BLOCK_SIZE', 1000),
+                               max_pending=getattr(settings, 'CHAT_MAX_PENDING', 10000))
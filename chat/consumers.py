@@ -1,34 +1,94 @@
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
-from django.utils import timezone
+from channels.db import DatabaseSyncToAsync
+from channels.generic.websocket import AsyncJsonWebsocketConsumer, JsonWebsocketConsumer
+from django.conf import settings
 
-from chat.models import Message, ChatGroup
+from chat.buffer import message_buffer
+from chat.fanout import fanout
+from chat.history import HISTORY_PAGE_SIZE, MAX_HISTORY_PAGE_SIZE, history_event, message_to_json
+from chat.membership import cached_membership, join_course_chat, room_name
+from chat.models import ChatGroup
+from chat.presence import presence
+from chat.protocol import BINARY_SUBPROTOCOL, BinaryEncoder
+from chat.recent import last_messages, recent_messages
+from chat.search import search_event, search_params
+
+logger = logging.getLogger(__name__)
+
+# ids are 64 bit signed integers in the database
+MAX_ID = 2 ** 63
+
+# every ORM call of the async consumer runs here, so the number of threads
+# and database connections stays fixed however many sockets are open
+db_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'CHAT_DB_WORKERS', 4),
+                                 thread_name_prefix='chat-db')
+
+
+def chat_db(func):
+    return DatabaseSyncToAsync(func, thread_sensitive=False, executor=db_executor)
+
+
+def history_cursor(data):
+    """``before_id`` and page size of a ``fetch_history`` request, ValueError when they are not valid."""
+    before_id = data.get('before_id')
+    try:
+        before_id = int(before_id) if before_id is not None else None
+        limit = int(data.get('limit') or HISTORY_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError('before_id and limit must be integers')
+    if before_id is not None and not 0 <= before_id < MAX_ID:
+        raise ValueError('before_id is out of range')
+    return before_id, max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+
+
+def error_event(request, error):
+    """Reply to a request the socket could not serve, the connection stays open."""
+    return {'type': 'error', 'request': request, 'error': str(error)}
+
+
+def negotiate_encoder(scope):
+    """Binary frames for clients offering the binary subprotocol, None keeps JSON."""
+    return BinaryEncoder() if BINARY_SUBPROTOCOL in scope.get('subprotocols', []) else None
+
+
+def chat_event(message):
+    return {'type': 'chat_message', **message_to_json(message)}
 
 
 class ChatConsumer(JsonWebsocketConsumer):
     def connect(self):
         self.user = self.scope['user']
         # get course id
-        self.course_id = self.scope['url_route']['kwargs']['course_id']
+        self.course_id = int(self.scope['url_route']['kwargs']['course_id'])
         # make group name
-        self.room_group_name = f"chat_{self.course_id}"
+        self.room_group_name = room_name(self.course_id)
 
-        # add group to db and add user to group
-        chat_group, _ = ChatGroup.objects.get_or_create(group_name=self.room_group_name)
-        chat_group.participants.add(self.user)
-        self.chat_group = chat_group
+        # only enrolled students get in, the socket is refused before the handshake completes
+        group_id = join_course_chat(self.user, self.course_id)
+        if not group_id:
+            self.close()
+            return
+        self.chat_group = ChatGroup(id=group_id, group_name=self.room_group_name)
 
         # add channel to group
         async_to_sync(self.channel_layer.group_add)(self.room_group_name, self.channel_name)
-        print(self.room_group_name, self.channel_name)
-        self.accept()
+        recent_messages.subscribe(group_id)
+        logger.debug(f"{self.channel_name} joined {self.room_group_name}")
+        self.encoder = negotiate_encoder(self.scope)
+        self.accept(BINARY_SUBPROTOCOL if self.encoder else None)
+        presence.join(self.course_id, self.user.pk)
+        async_to_sync(presence.report)(self.channel_layer, self.course_id, self.room_group_name)
 
     def disconnect(self, code):
-
-        # chat_group = ChatGroup.objects.get(group_name=self.room_group_name)
-        # chat_group.participants.remove(self.user)
+        # participants stay in ChatGroup, who is online lives in the cache
+        if getattr(self, 'chat_group', None) is not None:
+            recent_messages.unsubscribe(self.chat_group.id)
+            presence.leave(self.course_id, self.user.pk)
+            async_to_sync(presence.report)(self.channel_layer, self.course_id, self.room_group_name)
         self.chat_group = None
 
         # remove channel from group
@@ -37,57 +97,156 @@ class ChatConsumer(JsonWebsocketConsumer):
     def receive(self, text_data=None, bytes_data=None, **kwargs):
         text_data_json = json.loads(text_data)
         event_type = text_data_json['type']
-        message = text_data_json['message']
-
-        now = timezone.now()
 
         if event_type == 'fetch_messages':
             # fetch old messages
             self.fetch_messages(text_data_json)
+        elif event_type == 'fetch_history':
+            try:
+                cursor = history_cursor(text_data_json)
+            except ValueError as e:
+                self.send_event(error_event(event_type, e))
+            else:
+                self.send_event(history_event(self.chat_group, *cursor))
+        elif event_type == 'search':
+            try:
+                params = search_params(text_data_json)
+            except ValueError as e:
+                self.send_event(error_event(event_type, e))
+            else:
+                self.send_event(search_event(self.chat_group, *params))
+        elif event_type in ('heartbeat', 'typing'):
+            self.update_presence(event_type)
         else:
-            msg_id = self.save_chat(message)
-            # send message to group
-            async_to_sync(self.channel_layer.group_send)(self.room_group_name,
-                                                         {'type': 'chat_message',
-                                                          'message_id': msg_id,
-                                                          'creator': self.user.email,
-                                                          'content': message,
-                                                          'group_name': self.chat_group.id,
-                                                          'created_at': now.isoformat()})
+            presence.typing(self.course_id, self.user.pk, False)
+            msg = message_buffer.add(self.user, self.chat_group, text_data_json['message'])
+            event = chat_event(msg)
+            recent_messages.push(event)
+            # send message to group, it is written to the db shortly after
+            async_to_sync(fanout.publish)(self.channel_layer, self.room_group_name, event)
 
     def chat_message(self, event):
-        self.send_json(content={'type': 'chat_message', 'message': [event]})
+        self.chat_messages({'messages': [event]})
 
-    def fetch_messages(self, data):
-        messages = self.get_last_n_messages(20)
-        result = []
-        for message in messages:
-            msg = self.message_to_json(message)
-            msg['type'] = 'all_message'
-            result.append(msg)
+    def chat_messages(self, event):
+        # messages sent through other processes reach the room cache here
+        for message in event['messages']:
+            recent_messages.push(message)
+        self.send_event({'type': 'chat_message', 'message': event['messages']})
+
+    def send_event(self, content):
+        if self.encoder is None:
+            self.send_json(content=content)
+        else:
+            self.send(bytes_data=self.encoder.encode(content))
+
+    def presence_update(self, event):
+        self.send_event({'type': 'presence', 'online': event['online'], 'typing': event['typing']})
+
+    def update_presence(self, event_type):
+        if event_type == 'typing':
+            presence.typing(self.course_id, self.user.pk)
+        else:
+            presence.heartbeat(self.course_id, self.user.pk)
+        async_to_sync(presence.report)(self.channel_layer, self.course_id, self.room_group_name)
 
-        self.send_json(content={'type': 'all_message', 'message': result})
+    def fetch_messages(self, data):
+        self.send_event({'type': 'all_message', 'message': last_messages(self.chat_group.id, 20)})
 
-    def save_chat(self, message):
-        msg = Message.objects.create(
-            creator=self.user,
-            content=message,
-            chat_group=self.chat_group,
-        )
-        return msg.id
 
-    def get_last_n_messages(self, n=10):
-        return reversed(Message.objects.filter(chat_group__group_name=self.room_group_name)[:n])
+class AsyncChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Same protocol as ``ChatConsumer``, but an idle socket costs a coroutine
+    instead of a worker thread. Database work goes to ``db_executor``.
+    """
 
-    def message_to_json(self, message):
-        return {
-            'message_id': message.id,
-            'creator': message.creator.email,
-            'content': message.content,
-            'group_name': message.chat_group.id,
-            'created_at': message.created_at.isoformat()
-        }
+    async def connect(self):
+        self.user = self.scope['user']
+        self.course_id = int(self.scope['url_route']['kwargs']['course_id'])
+        self.room_group_name = room_name(self.course_id)
+
+        # returning members are answered from the cache without a thread hop
+        group_id = cached_membership(self.user, self.course_id)
+        if group_id is None:
+            group_id = await chat_db(join_course_chat)(self.user, self.course_id)
+        if not group_id:
+            await self.close()
+            return
+        self.chat_group = ChatGroup(id=group_id, group_name=self.room_group_name)
+
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        recent_messages.subscribe(group_id)
+        logger.debug(f"{self.channel_name} joined {self.room_group_name}")
+        self.encoder = negotiate_encoder(self.scope)
+        await self.accept(BINARY_SUBPROTOCOL if self.encoder else None)
+        presence.join(self.course_id, self.user.pk)
+        await presence.report(self.channel_layer, self.course_id, self.room_group_name)
+
+    async def disconnect(self, code):
+        if getattr(self, 'chat_group', None) is not None:
+            recent_messages.unsubscribe(self.chat_group.id)
+            presence.leave(self.course_id, self.user.pk)
+            await presence.report(self.channel_layer, self.course_id, self.room_group_name)
+        self.chat_group = None
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
+    async def receive_json(self, content, **kwargs):
+        event_type = content['type']
 
+        if event_type == 'fetch_messages':
+            await self.fetch_messages(content)
+        elif event_type == 'fetch_history':
+            try:
+                cursor = history_cursor(content)
+            except ValueError as e:
+                await self.send_event(error_event(event_type, e))
+            else:
+                await self.send_event(await chat_db(history_event)(self.chat_group, *cursor))
+        elif event_type == 'search':
+            try:
+                params = search_params(content)
+            except ValueError as e:
+                await self.send_event(error_event(event_type, e))
+            else:
+                await self.send_event(await chat_db(search_event)(self.chat_group, *params))
+        elif event_type in ('heartbeat', 'typing'):
+            await self.update_presence(event_type)
+        else:
+            presence.typing(self.course_id, self.user.pk, False)
+            if message_buffer.needs_ids:
+                await chat_db(message_buffer.reserve)()
+            msg = message_buffer.add(self.user, self.chat_group, content['message'])
+            event = chat_event(msg)
+            recent_messages.push(event)
+            await fanout.publish(self.channel_layer, self.room_group_name, event)
+
+    async def chat_message(self, event):
+        await self.chat_messages({'messages': [event]})
+
+    async def chat_messages(self, event):
+        for message in event['messages']:
+            recent_messages.push(message)
+        await self.send_event({'type': 'chat_message', 'message': event['messages']})
+
+    async def send_event(self, content):
+        if self.encoder is None:
+            await self.send_json(content=content)
+        else:
+            await self.send(bytes_data=self.encoder.encode(content))
 
+    async def presence_update(self, event):
+        await self.send_event({'type': 'presence', 'online': event['online'], 'typing': event['typing']})
 
+    async def update_presence(self, event_type):
+        if event_type == 'typing':
+            presence.typing(self.course_id, self.user.pk)
+        else:
+            presence.heartbeat(self.course_id, self.user.pk)
+        await presence.report(self.channel_layer, self.course_id, self.room_group_name)
+
+    async def fetch_messages(self, data):
+        messages = recent_messages.cached(self.chat_group.id, 20)
+        if messages is None:
+            messages = await chat_db(recent_messages.recent)(self.chat_group.id, 20)
+        messages = [{**message, 'type': 'all_message'} for message in messages]
+        await self.send_event({'type': 'all_message', 'message': messages})
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from django.conf import settings
+
+
+class _Room:
+    def __init__(self):
+        self.window = 0
+        self.count = 0
+        self.last_count = 0
+        self.pending = []
+        self.flushing = False
+
+    def rate(self, now):
+        """Messages per second, over the current and the previous whole second."""
+        window = int(now)
+        if window != self.window:
+            self.last_count = self.count if window == self.window + 1 else 0
+            self.window, self.count = window, 0
+        self.count += 1
+        return max(self.count, self.last_count)
+
+
+class Fanout:
+    """
+    Sends chat messages to a room's channel layer group.
+
+    In a quiet room every message is sent on its own. Once a room gets
+    ``rate`` or more messages a second, they are collected for ``tick``
+    seconds and sent as one ``chat_messages`` event. That is one group send
+    and one socket frame per subscriber for the whole batch. A ``tick`` of 0
+    turns batching off.
+    """
+
+    max_rooms = 1000
+
+    def __init__(self, tick=0.05, rate=20):
+        self.tick = tick
+        self.rate = rate
+        self.group_sends = 0
+        self.messages = 0
+        self._rooms = {}
+        self._flushes = set()
+
+    async def publish(self, channel_layer, group_name, event):
+        self.messages += 1
+        now = time.monotonic()
+        room = self._rooms.get(group_name)
+        if room is None:
+            if len(self._rooms) >= self.max_rooms:
+                self._forget_idle(now)
+            room = self._rooms[group_name] = _Room()
+        busy = room.rate(now) >= self.rate
+
+        # once a batch is open every message joins it, so none can overtake it
+        if self.tick and (busy or room.pending or room.flushing):
+            room.pending.append(event)
+            if len(room.pending) == 1 and not room.flushing:
+                asyncio.get_running_loop().call_later(self.tick, self._schedule, channel_layer, group_name)
+            return
+        self.group_sends += 1
+        await channel_layer.group_send(group_name, event)
+
+    def _schedule(self, channel_layer, group_name):
+        task = asyncio.ensure_future(self._flush(channel_layer, group_name))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, channel_layer, group_name):
+        room = self._rooms[group_name]
+        room.flushing = True
+        try:
+            while room.pending:
+                batch, room.pending = room.pending, []
+                self.group_sends += 1
+                await channel_layer.group_send(group_name, {'type': 'chat_messages', 'messages': batch})
+        finally:
+            room.flushing = False
+
+    def _forget_idle(self, now):
+        # rooms that were quiet for the last two seconds carry no state worth keeping
+        for group_name, room in list(self._rooms.items()):
+            if room.window < int(now) - 1 and not room.pending and not room.flushing:
+                del self._rooms[group_name]
+
+
+fanout = Fanout(tick=getattr(settings, 'CHAT_BATCH_TICK', 0.05),
+                rate=getattr(settings, 'CHAT_BATCH_RATE', 20))
@@ -0,0 +1,53 @@
+from django.db.models import Q, Subquery
+
+from chat.buffer import message_buffer
+from chat.models import Message
+
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+
+
+def message_to_json(message):
+    return {
+        'message_id': message.id,
+        'creator': message.creator.email,
+        'content': message.content,
+        'group_name': message.chat_group_id,
+        'created_at': message.created_at.isoformat()
+    }
+
+
+def history_page(chat_group_id, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Up to ``limit`` messages older than ``before_id`` (or the newest ones),
+    oldest first, and whether older messages exist. The cursor is resolved
+    inside the query, so every page costs one query however deep it is.
+    """
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+    # messages still waiting in the write-behind buffer are newer than anything in the table
+    pending = message_buffer.pending_for(chat_group_id)
+    messages = Message.objects.filter(chat_group_id=chat_group_id).select_related('creator')
+
+    if before_id is not None:
+        cursor = next((message for message in pending if message.id == before_id), None)
+        if cursor is not None:
+            created_at = cursor.created_at
+            pending = [message for message in pending if (message.created_at, message.id) < (created_at, before_id)]
+        else:
+            created_at = Subquery(Message.objects.filter(id=before_id, chat_group_id=chat_group_id)
+                                  .values('created_at')[:1])
+            pending = []
+        messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=before_id))
+
+    saved = messages.exclude(id__in=[message.id for message in pending]).order_by('-created_at', '-id')
+    newest_first = sorted([*saved[:limit + 1], *pending], key=lambda m: (m.created_at, m.id), reverse=True)
+    page = newest_first[:limit][::-1]
+    return page, len(newest_first) > limit
+
+
+def history_event(chat_group, before_id=None, limit=HISTORY_PAGE_SIZE):
+    page, has_more = history_page(chat_group.id, before_id, limit)
+    return {'type': 'history',
+            'message': [message_to_json(message) for message in page],
+            'before_id': page[0].id if page else None,
+            'has_more': has_more}
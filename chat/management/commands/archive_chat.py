@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from chat.archive import RETENTION_DAYS, archive_messages
+
+
+class Command(BaseCommand):
+    help = ('Move chat messages older than their retention into compressed archive segments. '
+            f'Rooms keep messages for their own retention_days, or {RETENTION_DAYS} days.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Override the retention of every room.')
+
+    def handle(self, *args, **options):
+        moved = archive_messages(days=options['days'])
+        for chat_group_id, count in moved.items():
+            if count:
+                self.stdout.write(f"chat group {chat_group_id}: {count} messages archived")
+        self.stdout.write(self.style.SUCCESS(f"{sum(moved.values())} messages archived"))
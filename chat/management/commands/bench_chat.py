@@ -0,0 +1,94 @@
+import asyncio
+import statistics
+import threading
+import time
+import tracemalloc
+
+from channels.routing import URLRouter
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import re_path
+
+from chat.fanout import fanout
+from chat.routing import CHAT_CONSUMERS
+from courses.models import Course, Subject
+
+try:
+    # channels.testing imports daphne, a development requirement
+    from channels.testing import WebsocketCommunicator
+except ImportError:
+    WebsocketCommunicator = None
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class Command(BaseCommand):
+    help = ('Compare the sync and async chat consumers on the in-memory channel layer. '
+            'Runs against a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=20)
+        parser.add_argument('--modes', nargs='+', choices=list(CHAT_CONSUMERS), default=list(CHAT_CONSUMERS))
+
+    def handle(self, *args, **options):
+        if WebsocketCommunicator is None:
+            raise CommandError("bench_chat needs daphne, install requirements/dev.txt")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user = get_user_model().objects.create_user(email='bench-chat@example.com', password=None)
+            subject = Subject.objects.create(title='Bench', slug='bench')
+            course = Course.objects.create(owner=user, subject=subject, title='Bench', slug='bench', overview='')
+            course.students.add(user)
+            self.stdout.write(f"{'mode':>6} {'conns':>6} {'threads':>8} {'KiB/conn':>9} {'connect ms':>11} "
+                              f"{'p50 ms':>8} {'p95 ms':>8} {'sends':>6}")
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+                for mode in options['modes']:
+                    row = asyncio.run(self.run_mode(mode, user, course.id, options['connections'],
+                                                    options['messages']))
+                    self.stdout.write(f"{mode:>6} {options['connections']:>6} {row['threads']:>8} "
+                                      f"{row['kib']:>9.1f} {row['connect']:>11.2f} {row['p50']:>8.2f} "
+                                      f"{row['p95']:>8.2f} {row['sends']:>6}")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    async def run_mode(self, mode, user, course_id, connections, messages):
+        application = URLRouter([re_path(r'ws/chat/room/(?P<course_id>\d+)/$', CHAT_CONSUMERS[mode].as_asgi())])
+
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        communicators = []
+        for _ in range(connections):
+            communicator = WebsocketCommunicator(application, f"/ws/chat/room/{course_id}/")
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect(timeout=10)
+            assert connected
+            communicators.append(communicator)
+        connect = (time.perf_counter() - start) / connections * 1000
+        kib = (tracemalloc.get_traced_memory()[0] - memory_before) / connections / 1024
+        tracemalloc.stop()
+        threads = threading.active_count()
+
+        sends = fanout.group_sends
+        latencies = []
+        for i in range(messages):
+            start = time.perf_counter()
+            await communicators[0].send_json_to({'type': 'single_message', 'message': f"message {i}"})
+            await asyncio.gather(*(self.receive_message(c) for c in communicators))
+            latencies.append((time.perf_counter() - start) * 1000)
+        sends = fanout.group_sends - sends
+
+        for communicator in communicators:
+            await communicator.disconnect()
+
+        return {'threads': threads, 'kib': kib, 'connect': connect, 'sends': sends,
+                'p50': statistics.median(latencies),
+                'p95': statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]}
+
+    async def receive_message(self, communicator):
+        # online counts arrive on the same socket
+        while (await communicator.receive_json_from(timeout=30))['type'] == 'presence':
+            pass
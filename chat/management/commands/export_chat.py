@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.archive import export_chunks
+from chat.membership import room_name
+from chat.models import ChatGroup
+
+
+class Command(BaseCommand):
+    help = "Write a course chat's full history, archived and live, as gzip JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id', type=int)
+        parser.add_argument('-o', '--output', help='File to write, standard output by default.')
+
+    def handle(self, *args, **options):
+        chat_group = ChatGroup.objects.filter(group_name=room_name(options['course_id'])).first()
+        if chat_group is None:
+            raise CommandError(f"Course {options['course_id']} has no chat")
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in export_chunks(chat_group.id):
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
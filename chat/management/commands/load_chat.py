@@ -0,0 +1,175 @@
+import asyncio
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from django.utils.module_loading import import_string
+
+from chat.buffer import message_buffer
+from courses.models import Course, Subject
+
+try:
+    # channels.testing imports daphne, a development requirement
+    from channels.testing import WebsocketCommunicator
+except ImportError:
+    WebsocketCommunicator = None
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class QueryCounter:
+    """Counts queries on every database connection, including the chat executor threads."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = ('Load-test the chat through educa.asgi in-process: ROOMS rooms of CLIENTS sockets each, '
+            'sending RATE messages a second per room. Runs offline against a throwaway test database '
+            'and the in-memory channel layer.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=5)
+        parser.add_argument('--clients', type=int, default=50, help='Sockets per room.')
+        parser.add_argument('--rate', type=float, default=10, help='Messages a second per room.')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds of sending.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if WebsocketCommunicator is None:
+            raise CommandError("load_chat needs daphne, install requirements/dev.txt")
+        random.seed(options['seed'])
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        queries = QueryCounter()
+        connection_created.connect(queries.install)
+        for conn in connections.all(initialized_only=True):
+            queries.install(conn)
+        try:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+                rooms = self.setup_rooms(options['rooms'], options['clients'])
+                from educa.asgi import application
+                report = asyncio.run(self.run(application, rooms, queries, options))
+        finally:
+            connection_created.disconnect(queries.install)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for label, value in report.items():
+            self.stdout.write(f"{label:>24}: {value}")
+
+    def setup_rooms(self, room_count, clients):
+        """One course per room with its own enrolled users, and a session cookie for each user."""
+        User = get_user_model()
+        subject = Subject.objects.create(title='Load test', slug='load-test')
+        owner = User.objects.create_user(email='load-owner@example.com', password=None)
+        engine = import_string(f"{settings.SESSION_ENGINE}.SessionStore")
+        rooms = []
+        for r in range(room_count):
+            course = Course.objects.create(owner=owner, subject=subject, title=f"Room {r}", slug=f"room-{r}",
+                                           overview='')
+            users = User.objects.bulk_create([User(email=f"load-{r}-{c}@example.com", password='!')
+                                              for c in range(clients)])
+            course.students.add(*users)
+            cookies = []
+            for user in users:
+                session = engine()
+                session[SESSION_KEY] = str(user.pk)
+                session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+                session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+                session.create()
+                cookies.append(f"{settings.SESSION_COOKIE_NAME}={session.session_key}".encode())
+            rooms.append((course.id, cookies))
+        return rooms
+
+    async def run(self, application, rooms, queries, options):
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        connect_times = []
+        sockets = []
+        for course_id, cookies in rooms:
+            room = []
+            for cookie in cookies:
+                communicator = WebsocketCommunicator(application, f"/ws/chat/room/{course_id}/",
+                                                     headers=[(b'cookie', cookie)])
+                start = time.perf_counter()
+                connected, _ = await communicator.connect(timeout=30)
+                connect_times.append((time.perf_counter() - start) * 1000)
+                assert connected, f"socket to room {course_id} was refused"
+                room.append(communicator)
+            sockets.append(room)
+        connections_open = sum(len(room) for room in sockets)
+        memory = (tracemalloc.get_traced_memory()[0] - memory_before) / connections_open / 1024
+        tracemalloc.stop()
+
+        latencies = []
+        receivers = [asyncio.create_task(self.receive(c, latencies)) for room in sockets for c in room]
+        queries.count = 0
+        sent = await asyncio.gather(*(self.send(room, options['rate'], options['duration']) for room in sockets))
+
+        # every message reaches every socket of its room, the sender's included
+        expected = sum(count * len(room) for count, room in zip(sent, sockets))
+        deadline = time.monotonic() + 10
+        while len(latencies) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in receivers:
+            task.cancel()
+        await asyncio.to_thread(message_buffer.flush)
+        message_queries = queries.count
+
+        for room in sockets:
+            for communicator in room:
+                await communicator.disconnect()
+
+        latencies.sort()
+        return {
+            'sockets': connections_open,
+            'connect ms (mean)': f"{statistics.mean(connect_times):.2f}",
+            'connect ms (p95)': f"{self.percentile(sorted(connect_times), 95):.2f}",
+            'KiB per connection': f"{memory:.1f}",
+            'messages sent': sum(sent),
+            'deliveries': f"{len(latencies)} of {expected}",
+            'fan-out ms (p50)': f"{self.percentile(latencies, 50):.2f}",
+            'fan-out ms (p95)': f"{self.percentile(latencies, 95):.2f}",
+            'fan-out ms (p99)': f"{self.percentile(latencies, 99):.2f}",
+            'queries per message': f"{message_queries / sum(sent):.3f}" if sum(sent) else '-',
+        }
+
+    async def send(self, room, rate, duration):
+        """Send from random sockets of the room at ``rate`` messages a second, stamped with the send time."""
+        interval = 1 / rate
+        start = time.perf_counter()
+        sent = 0
+        while time.perf_counter() - start < duration:
+            await random.choice(room).send_json_to({'type': 'single_message', 'message': repr(time.perf_counter())})
+            sent += 1
+            await asyncio.sleep(max(0, start + sent * interval - time.perf_counter()))
+        return sent
+
+    async def receive(self, communicator, latencies):
+        while True:
+            event = await communicator.receive_json_from(timeout=3600)
+            if event['type'] != 'chat_message':
+                continue
+            now = time.perf_counter()
+            latencies.extend((now - float(message['content'])) * 1000 for message in event['message'])
+
+    @staticmethod
+    def percentile(values, pct):
+        if not values:
+            return 0
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from chat.models import ChatGroup
+from courses.enrollment import is_enrolled
+
+MEMBER_TIMEOUT = getattr(settings, 'CHAT_MEMBER_TIMEOUT', 60 * 60 * 24)
+# refusals expire quickly, a student who enrolls is also let in by the signal
+DENIED_TIMEOUT = getattr(settings, 'CHAT_DENIED_TIMEOUT', 60)
+
+
+def room_name(course_id):
+    return f"chat_{course_id}"
+
+
+def room_course_id(group_name):
+    """The course id of a ``room_name``, None for any other group."""
+    prefix, _, course_id = group_name.partition('_')
+    return int(course_id) if prefix == 'chat' and course_id.isdigit() else None
+
+
+def member_key(course_id, user_id):
+    return f"chat_member_{course_id}_{user_id}"
+
+
+def chat_group_id(course_id):
+    """Id of the course's ChatGroup, created on first use."""
+    key = f"chat_group_{course_id}"
+    group_id = cache.get(key)
+    if group_id is None:
+        group_id = ChatGroup.objects.get_or_create(group_name=room_name(course_id))[0].id
+        cache.set(key, group_id, timeout=None)
+    return group_id
+
+
+def cached_membership(user, course_id):
+    """
+    What the cache knows about ``user`` in the course chat: the ChatGroup id
+    for a member, 0 for someone who may not join, None when it doesn't know.
+    """
+    if not user.is_authenticated:
+        return 0
+    return cache.get(member_key(course_id, user.pk))
+
+
+def join_course_chat(user, course_id):
+    """
+    Check that ``user`` is enrolled in the course and record them as a
+    participant. Returns the ChatGroup id, or 0 when they may not join.
+    The answer is cached, so later connects need no query at all.
+    """
+    membership = cached_membership(user, course_id)
+    if membership is not None:
+        return membership
+
+    if not is_enrolled(user, course_id):
+        cache.set(member_key(course_id, user.pk), 0, timeout=DENIED_TIMEOUT)
+        return 0
+    group_id = chat_group_id(course_id)
+    ChatGroup.participants.through.objects.bulk_create(
+        [ChatGroup.participants.through(chatgroup_id=group_id, user_id=user.pk)], ignore_conflicts=True)
+    cache.set(member_key(course_id, user.pk), group_id, timeout=MEMBER_TIMEOUT)
+    return group_id
+
+
+def forget_members(course_ids, user_ids):
+    cache.delete_many([member_key(course_id, user_id) for course_id in course_ids for user_id in user_ids])
@@ -0,0 +1,20 @@
+# Generated by Django 5.0 on 2026-10-18 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0002_idblock"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["chat_group", "created_at", "id"],
+                name="chat_messag_chat_gr_1b2681_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0 on 2026-10-18 15:17
+
+from django.conf import settings
+from django.db import migrations
+
+MESSAGE_TABLE = "chat_message"
+SEARCH_TABLE = "chat_message_search"
+# text search configuration of the Postgres index, 'simple' does no stemming
+SEARCH_CONFIG = getattr(settings, "CHAT_SEARCH_CONFIG", "simple")
+
+SQLITE_INDEX = [
+    # external content table, the text itself stays in chat_message
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+        USING fts5(content, chat_group_id, content='{MESSAGE_TABLE}', content_rowid='id')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON {MESSAGE_TABLE} BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, content, chat_group_id) VALUES (new.id, new.content, new.chat_group_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON {MESSAGE_TABLE} BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, content, chat_group_id)
+        VALUES ('delete', old.id, old.content, old.chat_group_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE ON {MESSAGE_TABLE} BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, content, chat_group_id)
+        VALUES ('delete', old.id, old.content, old.chat_group_id);
+        INSERT INTO {SEARCH_TABLE}(rowid, content, chat_group_id) VALUES (new.id, new.content, new.chat_group_id);
+    END""",
+    # index the messages written before the table existed
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_update",
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for statement in SQLITE_INDEX:
+            schema_editor.execute(statement)
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE} ON {MESSAGE_TABLE} "
+            f"USING gin (to_tsvector('{SEARCH_CONFIG}', content))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+    elif vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0003_message_group_created_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
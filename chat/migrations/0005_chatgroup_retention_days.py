@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_message_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatgroup",
+            name="retention_days",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,18 +1,22 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 class ChatGroup(models.Model):
     group_name = models.CharField(max_length=100, unique=True)
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='chats')
     created_at = models.DateTimeField(auto_now_add=True)
+    # days messages stay in the table before they are archived, CHAT_RETENTION_DAYS when empty
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
 
 
 class Message(models.Model):
     creator = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='messages', on_delete=models.CASCADE)
     content = models.TextField()
     chat_group = models.ForeignKey(ChatGroup, related_name='messages', on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # set when the message is broadcast, which can be a moment before it is written
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     def to_json(self):
         return {
@@ -28,5 +32,13 @@ class Message(models.Model):
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [models.Index(fields=['chat_group', 'created_at', 'id'])]
+
 
+class IdBlock(models.Model):
+    """High-water mark of ids handed out in blocks, so rows can get an id before they are written."""
+    name = models.CharField(max_length=100, unique=True)
+    next_id = models.PositiveBigIntegerField()
 
+    def __str__(self):
+        return f"{self.name}: {self.next_id}"
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+# clients send a heartbeat this often, a user who misses two is counted offline
+HEARTBEAT_INTERVAL = getattr(settings, 'CHAT_HEARTBEAT_INTERVAL', 20)
+ONLINE_TIMEOUT = HEARTBEAT_INTERVAL * 3
+TYPING_TIMEOUT = getattr(settings, 'CHAT_TYPING_TIMEOUT', 5)
+
+
+def online_key(course_id, user_id):
+    return f"chat_online_{course_id}_{user_id}"
+
+
+def typing_key(course_id, user_id):
+    return f"chat_typing_{course_id}_{user_id}"
+
+
+def epoch(now=None):
+    """Number of the ``ONLINE_TIMEOUT`` long window ``now`` falls in."""
+    return int((time.time() if now is None else now) // ONLINE_TIMEOUT)
+
+
+def roster_size_key(course_id, epoch):
+    return f"chat_roster_{course_id}_{epoch}"
+
+
+def roster_slot_key(course_id, epoch, slot):
+    return f"chat_roster_{course_id}_{epoch}_{slot}"
+
+
+def roster_member_key(course_id, epoch, user_id):
+    return f"chat_roster_{course_id}_{epoch}_user_{user_id}"
+
+
+class Presence:
+    """
+    Who is online and who is typing in each chat room, kept in the cache.
+
+    Each user has an online key that heartbeats keep alive and a typing
+    key that expires on its own. To find them, a room keeps a roster per
+    ``ONLINE_TIMEOUT`` window: the first heartbeat of a user in a window
+    claims a numbered slot with ``cache.add`` and ``cache.incr``, so
+    processes never overwrite each other's entries. Everyone online
+    heartbeats at least once per window, so the current and the previous
+    window together list every online user, and older windows simply
+    expire. Rooms get ``presence`` events with the counts only, at most
+    once per ``interval`` across all processes and only when they changed.
+    Nothing touches the database.
+    """
+
+    def __init__(self, interval=2):
+        self.interval = interval
+        self._connections = Counter()
+        self._retrying = set()
+        self._retries = set()
+
+    def join(self, course_id, user_id):
+        self._connections[course_id, user_id] += 1
+        self.heartbeat(course_id, user_id)
+
+    def heartbeat(self, course_id, user_id):
+        cache.set(online_key(course_id, user_id), 1, timeout=ONLINE_TIMEOUT)
+        window = epoch()
+        if cache.add(roster_member_key(course_id, window, user_id), 1, timeout=ONLINE_TIMEOUT * 2):
+            size_key = roster_size_key(course_id, window)
+            cache.add(size_key, 0, timeout=ONLINE_TIMEOUT * 2)
+            slot = cache.incr(size_key)
+            cache.set(roster_slot_key(course_id, window, slot), user_id, timeout=ONLINE_TIMEOUT * 2)
+
+    def leave(self, course_id, user_id):
+        self._connections[course_id, user_id] -= 1
+        # another tab of the same user may still be open in this process
+        if self._connections[course_id, user_id] <= 0:
+            del self._connections[course_id, user_id]
+            cache.delete_many([online_key(course_id, user_id), typing_key(course_id, user_id)])
+
+    def typing(self, course_id, user_id, typing=True):
+        if typing:
+            cache.set(typing_key(course_id, user_id), 1, timeout=TYPING_TIMEOUT)
+        else:
+            cache.delete(typing_key(course_id, user_id))
+
+    def roster(self, course_id):
+        """Ids of the users who heartbeated in this room during the current or the previous window."""
+        window = epoch()
+        windows = (window - 1, window)
+        sizes = cache.get_many([roster_size_key(course_id, w) for w in windows])
+        slots = [roster_slot_key(course_id, w, slot) for w in windows
+                 for slot in range(1, sizes.get(roster_size_key(course_id, w), 0) + 1)]
+        return set(cache.get_many(slots).values())
+
+    def counts(self, course_id):
+        roster = self.roster(course_id)
+        online = cache.get_many([online_key(course_id, user_id) for user_id in roster])
+        alive = [user_id for user_id in roster if online_key(course_id, user_id) in online]
+        typing = cache.get_many([typing_key(course_id, user_id) for user_id in alive])
+        return {'online': len(alive), 'typing': len(typing)}
+
+    async def report(self, channel_layer, course_id, group_name):
+        """Send the room's counts if they changed, at most once per ``interval``."""
+        if course_id in self._retrying:
+            return
+        if not cache.add(f"chat_presence_sent_{course_id}", 1, timeout=self.interval):
+            # another report went out moments ago, make sure this change follows it
+            self._retrying.add(course_id)
+            asyncio.get_running_loop().call_later(self.interval, self._retry, channel_layer, course_id, group_name)
+            return
+
+        counts = self.counts(course_id)
+        if cache.get(f"chat_presence_{course_id}") == counts:
+            return
+        cache.set(f"chat_presence_{course_id}", counts, timeout=ONLINE_TIMEOUT)
+        await channel_layer.group_send(group_name, {'type': 'presence.update', **counts})
+
+    def _retry(self, channel_layer, course_id, group_name):
+        self._retrying.discard(course_id)
+        task = asyncio.ensure_future(self.report(channel_layer, course_id, group_name))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+
+presence = Presence(interval=getattr(settings, 'CHAT_PRESENCE_INTERVAL', 2))
@@ -0,0 +1,85 @@
+from datetime import datetime
+
+# offered by clients that can read binary frames, everyone else gets JSON
+BINARY_SUBPROTOCOL = 'educa.chat.binary'
+
+CHAT_MESSAGE, ALL_MESSAGE, HISTORY, SEARCH, PRESENCE, ERROR = range(1, 7)
+FRAME_TYPES = {'chat_message': CHAT_MESSAGE, 'all_message': ALL_MESSAGE, 'history': HISTORY,
+               'search': SEARCH, 'presence': PRESENCE, 'error': ERROR}
+
+
+def varint(value):
+    """Unsigned LEB128: seven bits per byte, low bits first."""
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def text(value):
+    data = value.encode()
+    return varint(len(data)) + data
+
+
+class BinaryEncoder:
+    """
+    Encodes server events of one socket as binary frames.
+
+    Every integer is a varint and every string a varint length followed by
+    UTF-8. A frame starts with its type byte. Frames carrying messages list
+    the creators not seen before on this socket as (ref, email) pairs, and
+    after that each message refers to its creator by ref only. Timestamps
+    are milliseconds since the epoch.
+
+    ::
+
+        chat_message, all_message   users messages
+        history                     before_id + 1 (0 for none), has_more, users, messages
+        search                      page, has_more, query, users, messages
+        presence                    online, typing
+        error                       request, error
+
+        users     count, (ref, email) * count
+        messages  count, (message_id, creator ref, created_at ms, content) * count
+    """
+
+    def __init__(self):
+        self.creators = {}
+
+    def encode(self, event):
+        kind = FRAME_TYPES[event['type']]
+        frame = bytearray([kind])
+        if kind == PRESENCE:
+            frame += varint(event['online']) + varint(event['typing'])
+            return bytes(frame)
+        if kind == ERROR:
+            frame += text(event['request']) + text(event['error'])
+            return bytes(frame)
+        if kind == HISTORY:
+            frame += varint((event['before_id'] or -1) + 1) + varint(int(event['has_more']))
+        elif kind == SEARCH:
+            frame += varint(event['page']) + varint(int(event['has_more'])) + text(event['query'])
+        frame += self.messages(event['message'])
+        return bytes(frame)
+
+    def messages(self, messages):
+        new = []
+        for message in messages:
+            if message['creator'] not in self.creators:
+                self.creators[message['creator']] = len(self.creators)
+                new.append(message['creator'])
+
+        out = bytearray(varint(len(new)))
+        for email in new:
+            out += varint(self.creators[email]) + text(email)
+        out += varint(len(messages))
+        for message in messages:
+            created_at = datetime.fromisoformat(message['created_at'])
+            out += (varint(message['message_id']) + varint(self.creators[message['creator']]) +
+                    varint(int(created_at.timestamp() * 1000)) + text(message['content']))
+        return out
@@ -0,0 +1,135 @@
+import threading
+import time
+from bisect import insort
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+
+from chat.history import HISTORY_PAGE_SIZE, history_page, message_to_json
+
+
+class _Room:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # held by the thread filling the room from the database, never by the event loop
+        self.fill_lock = threading.Lock()
+        self.filled_at = None
+        self.entries = []  # ((created_at, id), message dict), oldest first
+        self.ids = set()
+
+
+class RecentMessages:
+    """
+    The newest ``size`` serialized messages of each chat room, in memory.
+
+    A room is filled from the database the first time it is read, once
+    however many sockets ask at the same moment. While a socket of this
+    process is subscribed to the room, every message of the room reaches
+    it through ``push``, so it stays current. Without one, other workers'
+    messages never arrive here and a fill is only trusted for ``ttl``
+    seconds. Only the ``max_rooms`` most recently used rooms stay resident.
+    """
+
+    def __init__(self, size=50, max_rooms=1000, ttl=5):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.ttl = ttl
+        self.fills = 0
+        self._rooms = OrderedDict()
+        self._subscribers = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def resident(self):
+        return len(self._rooms)
+
+    def subscribe(self, chat_group_id):
+        """A local socket joined the room's channel group, so it hears about every new message from now on."""
+        with self._lock:
+            self._subscribers[chat_group_id] += 1
+            if self._subscribers[chat_group_id] == 1:
+                # what an unsubscribed room holds may be missing messages, start over
+                self._rooms.pop(chat_group_id, None)
+
+    def unsubscribe(self, chat_group_id):
+        with self._lock:
+            self._subscribers[chat_group_id] -= 1
+            if self._subscribers[chat_group_id] <= 0:
+                del self._subscribers[chat_group_id]
+                room = self._rooms.get(chat_group_id)
+                if room is not None and room.filled_at is not None:
+                    # current until now, from here on only for the ttl
+                    room.filled_at = time.monotonic()
+
+    def _fresh(self, chat_group_id, room):
+        if room.filled_at is None:
+            return False
+        return chat_group_id in self._subscribers or time.monotonic() - room.filled_at < self.ttl
+
+    def cached(self, chat_group_id, n=HISTORY_PAGE_SIZE):
+        """The newest ``n`` messages, oldest first, or None when that needs the database."""
+        with self._lock:
+            room = self._rooms.get(chat_group_id)
+            if room is None or n > self.size or not self._fresh(chat_group_id, room):
+                return None
+            self._rooms.move_to_end(chat_group_id)
+        with room.lock:
+            return [message for _, message in room.entries[-n:]]
+
+    def recent(self, chat_group_id, n=HISTORY_PAGE_SIZE):
+        """The newest ``n`` messages, oldest first, filling the room when it isn't fresh."""
+        if n > self.size:
+            page, _ = history_page(chat_group_id, limit=n)
+            return [message_to_json(message) for message in page]
+
+        with self._lock:
+            room = self._rooms.get(chat_group_id)
+            if room is None:
+                room = self._rooms[chat_group_id] = _Room()
+                while len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+            self._rooms.move_to_end(chat_group_id)
+
+        with room.fill_lock:
+            with self._lock:
+                fresh = self._fresh(chat_group_id, room)
+            if not fresh:
+                started = time.monotonic()
+                # the query runs without room.lock, so push and cached never wait for it
+                page, _ = history_page(chat_group_id, limit=self.size)
+                with room.lock:
+                    # messages pushed while the room was filling are already in it
+                    for message in page:
+                        self._insert(room, message.created_at, message_to_json(message))
+                    room.filled_at = started
+                self.fills += 1
+        with room.lock:
+            return [message for _, message in room.entries[-n:]]
+
+    def push(self, message):
+        """Add a serialized message to its room if the room is resident. Repeated ids are ignored."""
+        room = self._rooms.get(message['group_name'])
+        if room is None:
+            return
+        message = {key: value for key, value in message.items() if key != 'type'}
+        with room.lock:
+            self._insert(room, datetime.fromisoformat(message['created_at']), message)
+
+    def _insert(self, room, created_at, message):
+        if message['message_id'] in room.ids:
+            return
+        room.ids.add(message['message_id'])
+        insort(room.entries, ((created_at, message['message_id']), message), key=lambda entry: entry[0])
+        if len(room.entries) > self.size:
+            _, oldest = room.entries.pop(0)
+            room.ids.discard(oldest['message_id'])
+
+
+def last_messages(chat_group_id, n=HISTORY_PAGE_SIZE):
+    return [{**message, 'type': 'all_message'} for message in recent_messages.recent(chat_group_id, n)]
+
+
+recent_messages = RecentMessages(size=getattr(settings, 'CHAT_RECENT_MESSAGES', 50),
+                                 max_rooms=getattr(settings, 'CHAT_RECENT_ROOMS', 1000),
+                                 ttl=getattr(settings, 'CHAT_RECENT_TTL', 5))
@@ -1,8 +1,14 @@
+from django.conf import settings
 from django.urls import re_path
 from chat import consumers
 
+# 'async' holds thousands of idle sockets per process, 'sync' takes a thread per socket
+CHAT_CONSUMERS = {
+    'async': consumers.AsyncChatConsumer,
+    'sync': consumers.ChatConsumer,
+}
+
 websocket_urlpatterns = [
-    re_path(r'ws/chat/room/(?P<course_id>\d+)/$', consumers.ChatConsumer.as_asgi())
+    re_path(r'ws/chat/room/(?P<course_id>\d+)/$',
+            CHAT_CONSUMERS[getattr(settings, 'CHAT_CONSUMER', 'async')].as_asgi())
 ]
-
-
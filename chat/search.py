@@ -0,0 +1,93 @@
+import re
+
+from django.conf import settings
+from django.db import connections
+
+from chat.history import message_to_json
+from chat.models import Message
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+# deeper pages cost an ever larger OFFSET scan
+MAX_SEARCH_PAGE = 1000
+# text search configuration of the Postgres index, 'simple' does no stemming
+SEARCH_CONFIG = getattr(settings, 'CHAT_SEARCH_CONFIG', 'simple')
+
+MESSAGE_TABLE = Message._meta.db_table
+# full-text index, created by the chat migration 0004_message_search
+SEARCH_TABLE = f'{MESSAGE_TABLE}_search'
+
+
+def fts5_query(text):
+    """Quote every word of ``text`` so FTS5 matches them all, the last one as a prefix."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def search_messages(chat_group_id, text, page=1, limit=SEARCH_PAGE_SIZE):
+    """
+    Messages of one chat group matching ``text``, best match first, and
+    whether there is another page. Only written messages are indexed, so a
+    message shows up once the write-behind buffer has flushed it.
+    """
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    offset = (max(page, 1) - 1) * limit
+    connection = connections[Message.objects.db]
+
+    if connection.vendor == 'sqlite':
+        query = fts5_query(text)
+        if query is None:
+            return [], False
+        sql = (f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+               f"ORDER BY bm25({SEARCH_TABLE}, 1.0, 0.0), rowid DESC LIMIT %s OFFSET %s")
+        params = [f'chat_group_id : "{int(chat_group_id)}" AND content : ({query})', limit + 1, offset]
+    elif connection.vendor == 'postgresql':
+        if not text.strip():
+            return [], False
+        vector = f"to_tsvector('{SEARCH_CONFIG}', content)"
+        query = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        sql = (f"SELECT id FROM {MESSAGE_TABLE} WHERE chat_group_id = %s AND {vector} @@ {query} "
+               f"ORDER BY ts_rank({vector}, {query}) DESC, id DESC LIMIT %s OFFSET %s")
+        params = [chat_group_id, text, text, limit + 1, offset]
+    else:
+        ids = (Message.objects.filter(chat_group_id=chat_group_id, content__icontains=text)
+               .order_by('-created_at', '-id').values_list('id', flat=True)[offset:offset + limit + 1])
+        return _messages(list(ids), limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+    return _messages(ids, limit)
+
+
+def _messages(ids, limit):
+    found = Message.objects.select_related('creator').in_bulk(ids[:limit])
+    return [found[pk] for pk in ids[:limit] if pk in found], len(ids) > limit
+
+
+def search_params(data):
+    """
+    Query text, page and capped page size of a search request with
+    ``query`` and an optional ``page`` and ``limit``, ValueError when they
+    are not valid.
+    """
+    try:
+        page = int(data.get('page') or 1)
+        limit = int(data.get('limit') or SEARCH_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError('page and limit must be integers')
+    if not 1 <= page <= MAX_SEARCH_PAGE:
+        raise ValueError(f'page must be between 1 and {MAX_SEARCH_PAGE}')
+    return str(data.get('query') or ''), page, max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+
+
+def search_event(chat_group, text, page=1, limit=SEARCH_PAGE_SIZE):
+    """Reply to a ``search`` request, see ``search_params``."""
+    messages, has_more = search_messages(chat_group.id, text, page, limit)
+    return {'type': 'search',
+            'query': text,
+            'page': page,
+            'message': [message_to_json(message) for message in messages],
+            'has_more': has_more}
@@ -0,0 +1,21 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from chat.membership import forget_members
+from courses.models import Course
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def forget_chat_members(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.courses_joined if reverse else instance.students
+        instance._chat_cleared_ids = set(related.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_chat_cleared_ids', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        forget_members(pk_set, [instance.pk])
+    else:
+        forget_members([instance.pk], pk_set)
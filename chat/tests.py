@@ -1,4 +1,713 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import tempfile
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import re_path
+from django.utils import timezone
 
+from accounts.models import User
+from chat.buffer import MessageBuffer, message_buffer
+from chat.fanout import Fanout, fanout
+from chat import archive, membership, recent
+from chat.history import history_event, message_to_json
+from chat.management.commands import load_chat
+from chat.membership import chat_group_id
+from chat.models import ChatGroup, Message
+from chat.presence import Presence, presence
+from chat.protocol import (ALL_MESSAGE, BINARY_SUBPROTOCOL, CHAT_MESSAGE, HISTORY, PRESENCE, BinaryEncoder,
+                           varint)
+from chat.recent import RecentMessages, recent_messages
+from chat.routing import CHAT_CONSUMERS
+from chat.search import MAX_SEARCH_PAGE_SIZE, search_messages
+from courses.models import Course, Subject
+from educa.asgi import application
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def communicator(mode, user, course_id):
+    application = URLRouter([re_path(r'ws/chat/room/(?P<course_id>\d+)/$', CHAT_CONSUMERS[mode].as_asgi())])
+    socket = WebsocketCommunicator(application, f'/ws/chat/room/{course_id}/')
+    socket.scope['user'] = user
+    return socket
+
+
+async def receive(socket, event_type):
+    """The next event of ``event_type``, skipping the presence updates in between."""
+    while True:
+        event = await socket.receive_json_from(timeout=5)
+        if event['type'] == event_type:
+            return event
+
+
+def enrolled_course(*users, slug='course'):
+    subject = Subject.objects.create(title='Subject', slug=slug)
+    course = Course.objects.create(owner=users[0], subject=subject, title='Course', slug=slug, overview='o')
+    course.students.add(*users)
+    return course
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class ChatTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        # write what the sockets sent before the flush thread finds the tables gone
+        message_buffer.flush()
+
+
+class ChatConsumerTests(ChatTestCase):
+    def test_both_consumers_relay_messages(self):
+        user = User.objects.create_user(email='student@example.com', password='x')
+        course = enrolled_course(user)
+
+        async def chat(mode):
+            sender, reader = communicator(mode, user, course.id), communicator(mode, user, course.id)
+            self.assertTrue((await sender.connect())[0])
+            self.assertTrue((await reader.connect())[0])
+            await sender.send_json_to({'type': 'single_message', 'message': f'hello {mode}'})
+            event = await receive(reader, 'chat_message')
+            await sender.disconnect()
+            await reader.disconnect()
+            return event['message'][0]['content']
+
+        for mode in CHAT_CONSUMERS:
+            self.assertEqual(async_to_sync(chat)(mode), f'hello {mode}')
+
+
+class MessageBufferTests(ChatTestCase):
+    def test_messages_get_ids_before_they_are_written(self):
+        user = User.objects.create_user(email='student@example.com', password='x')
+        course = enrolled_course(user)
+
+        async def chat(mode):
+            sender, reader = communicator(mode, user, course.id), communicator(mode, user, course.id)
+            await sender.connect()
+            await reader.connect()
+            ids = []
+            for i in range(5):
+                await sender.send_json_to({'type': 'single_message', 'message': f'{mode}{i}'})
+                ids.append((await receive(reader, 'chat_message'))['message'][0]['message_id'])
+            await sender.send_json_to({'type': 'fetch_messages', 'message': ''})
+            history = await receive(sender, 'all_message')
+            await sender.disconnect()
+            await reader.disconnect()
+            return ids, [message['content'] for message in history['message']]
+
+        for mode in CHAT_CONSUMERS:
+            ids, history = async_to_sync(chat)(mode)
+            self.assertEqual(len(set(ids)), 5)
+            self.assertEqual(history[-5:], [f'{mode}{i}' for i in range(5)])
+        message_buffer.flush()
+        self.assertEqual(message_buffer.pending, 0)
+        self.assertEqual(Message.objects.count(), 10)
+
+        self.client.force_login(User.objects.create_superuser(email='staff@example.com', password='x'))
+        self.assertEqual(self.client.get('/chat/metrics/').json()['pending_messages'], 0)
+
+    @mock.patch.object(MessageBuffer, '_start')
+    def test_unwritable_messages_are_dropped(self, start):
+        author = User.objects.create_user(email='author@example.com', password='x')
+        gone = User.objects.create_user(email='gone@example.com', password='x')
+        group = ChatGroup.objects.create(group_name='lobby')
+        buffer = MessageBuffer(max_pending=3)
+        buffer.add(gone, group, 'lost')
+        gone.delete()
+        buffer.add(author, group, 'kept')
+        with self.assertLogs('chat.buffer', 'WARNING'):
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.pending, 0)
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['kept'])
+
+    @mock.patch.object(MessageBuffer, '_start')
+    def test_retry_queue_is_capped(self, start):
+        author = User.objects.create_user(email='author@example.com', password='x')
+        group = ChatGroup.objects.create(group_name='lobby')
+        buffer = MessageBuffer(max_pending=3)
+        for i in range(3):
+            buffer.add(author, group, f'm{i}')
+        with self.assertLogs('chat.buffer', 'ERROR'):
+            buffer.requeue([Message(id=10 ** 6 + i, creator=author, chat_group=group, content='retry')
+                            for i in range(2)])
+        self.assertEqual(buffer.pending, 3)
+
+
+class HistoryTests(TestCase):
+    def test_pages_cost_one_query_at_any_depth(self):
+        user = User.objects.create_user(email='student@example.com', password='x')
+        group = ChatGroup.objects.create(group_name='lobby')
+        other = ChatGroup.objects.create(group_name='other')
+        now = timezone.now()
+        # every three messages share a created_at, the id breaks the tie
+        Message.objects.bulk_create([Message(creator=user, chat_group=group, content=str(i),
+                                             created_at=now + datetime.timedelta(seconds=i // 3))
+                                     for i in range(95)])
+        Message.objects.bulk_create([Message(creator=user, chat_group=other, content='x') for i in range(10)])
+
+        seen, before_id = [], None
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                event = history_event(group, before_id, 20)
+            self.assertEqual(len(queries), 1)
+            seen = [message['content'] for message in event['message']] + seen
+            before_id = event['before_id']
+            if not event['has_more']:
+                break
+        self.assertEqual(seen, [str(i) for i in range(95)])
+
+
+class HistoryCursorTests(ChatTestCase):
+    def test_malformed_cursor_gets_an_error_frame(self):
+        user = User.objects.create_user(email='student@example.com', password='x')
+        course = enrolled_course(user)
+
+        async def fetch(mode):
+            socket = communicator(mode, user, course.id)
+            await socket.connect()
+            for bad in ({'before_id': 'x'}, {'before_id': [1]}, {'limit': [2]}, {'before_id': 10 ** 30}):
+                await socket.send_json_to({'type': 'fetch_history', **bad})
+                self.assertEqual((await receive(socket, 'error'))['request'], 'fetch_history')
+            await socket.send_json_to({'type': 'fetch_history', 'limit': 10 ** 9})
+            self.assertEqual((await receive(socket, 'history'))['message'], [])
+            await socket.disconnect()
+
+            binary = communicator(mode, user, course.id)
+            binary.scope['subprotocols'] = [BINARY_SUBPROTOCOL]
+            await binary.connect()
+            await binary.send_json_to({'type': 'fetch_history', 'before_id': 'x'})
+            while (frame := await binary.receive_from(timeout=5))[0] != 6:
+                pass
+            self.assertIn(b'before_id and limit must be integers', frame)
+            await binary.disconnect()
+
+        for mode in CHAT_CONSUMERS:
+            async_to_sync(fetch)(mode)
+
+
+class RecentMessagesTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com', password='x')
+        self.groups = [ChatGroup.objects.create(group_name=f'room{i}') for i in range(3)]
+
+    def say(self, content, group=None):
+        message = Message.objects.create(creator=self.user, chat_group=group or self.groups[0], content=content)
+        return {'type': 'chat_message', **message_to_json(message)}
+
+    def contents(self, messages):
+        return [message['content'] for message in messages]
+
+    def test_one_fill_per_room(self):
+        group = self.groups[0]
+        Message.objects.bulk_create([Message(creator=self.user, chat_group=group, content=str(i)) for i in range(60)])
+        rooms = RecentMessages(size=50, max_rooms=2)
+        with CaptureQueriesContext(connection) as queries:
+            first = rooms.recent(group.id, 20)
+            rooms.recent(group.id, 20)
+            self.assertEqual(len(rooms.cached(group.id, 50)), 50)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.contents(first), [str(i) for i in range(40, 60)])
+
+        event = self.say('new')
+        rooms.push(event)
+        rooms.push(event)
+        self.assertEqual(self.contents(rooms.cached(group.id, 2)), ['59', 'new'])
+        self.assertNotIn('type', rooms.cached(group.id, 1)[0])
+
+        rooms.recent(self.groups[1].id)
+        rooms.recent(self.groups[2].id)
+        self.assertIsNone(rooms.cached(group.id))
+        self.assertEqual(rooms.resident, 2)
+
+    def test_unsubscribed_rooms_expire(self):
+        group = self.groups[0]
+        self.say('one')
+        rooms = RecentMessages(ttl=0.2)
+        self.assertEqual(self.contents(rooms.recent(group.id)), ['one'])
+        # written by another process, this one only learns about it by refilling
+        self.say('two')
+        self.assertIsNotNone(rooms.cached(group.id))
+        time.sleep(0.25)
+        self.assertIsNone(rooms.cached(group.id))
+        self.assertEqual(self.contents(rooms.recent(group.id)), ['one', 'two'])
+
+        rooms.subscribe(group.id)
+        rooms.recent(group.id)
+        fills = rooms.fills
+        time.sleep(0.25)
+        rooms.push(self.say('three'))
+        self.assertEqual(self.contents(rooms.cached(group.id)), ['one', 'two', 'three'])
+        self.assertEqual(rooms.fills, fills)
+        rooms.unsubscribe(group.id)
+        time.sleep(0.25)
+        self.assertIsNone(rooms.cached(group.id))
+
+    def test_push_does_not_wait_for_a_fill(self):
+        group = self.groups[0]
+        self.say('one')
+        rooms = RecentMessages()
+        rooms.subscribe(group.id)
+        gate = threading.Event()
+        history_page = recent.history_page
+
+        def slow_history_page(*args, **kwargs):
+            gate.wait(5)
+            return history_page(*args, **kwargs)
+
+        with mock.patch.object(recent, 'history_page', slow_history_page):
+            fill = threading.Thread(target=rooms.recent, args=(group.id,))
+            fill.start()
+            time.sleep(0.1)
+            event = self.say('two')
+            start = time.monotonic()
+            rooms.push(event)
+            self.assertLess(time.monotonic() - start, 0.05)
+            self.assertIsNone(rooms.cached(group.id))
+            gate.set()
+            fill.join()
+        self.assertEqual(self.contents(rooms.cached(group.id)), ['one', 'two'])
+
+
+class RecentMessagesBurstTests(ChatTestCase):
+    def test_a_burst_of_connects_fills_the_room_once(self):
+        user = User.objects.create_user(email='student@example.com', password='x')
+        course = enrolled_course(user)
+        group = ChatGroup.objects.create(group_name=f'chat_{course.id}')
+        Message.objects.bulk_create([Message(creator=user, chat_group=group, content=str(i)) for i in range(30)])
+        recent_messages._rooms.clear()
+        fills = recent_messages.fills
+
+        async def burst():
+            sockets = [communicator('async', user, course.id) for _ in range(200)]
+            for socket in sockets:
+                await socket.connect()
+            await asyncio.gather(*(socket.send_json_to({'type': 'fetch_messages', 'message': ''})
+                                   for socket in sockets))
+            replies = await asyncio.gather(*(receive(socket, 'all_message') for socket in sockets))
+            await asyncio.gather(*(socket.disconnect() for socket in sockets))
+            return replies
+
+        replies = async_to_sync(burst)()
+        self.assertEqual(recent_messages.fills - fills, 1)
+        for reply in replies:
+            self.assertEqual(len(reply['message']), 20)
+            self.assertEqual(reply['message'][-1]['content'], '29')
+
+
+class ChatMembershipTests(ChatTestCase):
+    def connects(self, mode, user, course_id):
+        async def attempt():
+            socket = communicator(mode, user, course_id)
+            connected, _ = await socket.connect()
+            if connected:
+                await socket.disconnect()
+            return connected
+        return async_to_sync(attempt)()
+
+    def test_returning_members_are_answered_from_the_cache(self):
+        student = User.objects.create_user(email='student@example.com', password='x')
+        outsider = User.objects.create_user(email='outsider@example.com', password='x')
+        course = enrolled_course(student)
+
+        with mock.patch('chat.membership.is_enrolled', wraps=membership.is_enrolled) as is_enrolled:
+            for mode in CHAT_CONSUMERS:
+                for _ in range(5):
+                    self.assertTrue(self.connects(mode, student, course.id))
+                    self.assertFalse(self.connects(mode, outsider, course.id))
+        self.assertEqual(is_enrolled.call_count, 2)
+        self.assertEqual(ChatGroup.objects.get().participants.count(), 1)
+
+    def test_enrollment_changes_reach_the_cache(self):
+        student = User.objects.create_user(email='student@example.com', password='x')
+        other = User.objects.create_user(email='other@example.com', password='x')
+        course = enrolled_course(student)
+        self.assertTrue(self.connects('async', student, course.id))
+        self.assertFalse(self.connects('async', other, course.id))
+
+        course.students.add(other)
+        self.assertTrue(self.connects('async', other, course.id))
+        course.students.remove(student)
+        self.assertFalse(self.connects('async', student, course.id))
+        other.courses_joined.clear()
+        self.assertFalse(self.connects('sync', other, course.id))
+
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(f'/chat/room/{course.id}/').status_code, 403)
+
+
+class RecordingLayer:
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group_name, event):
+        self.sent.append(event)
+
+
+class FanoutTests(ChatTestCase):
+    def contents(self, sent):
+        events = []
+        for event in sent:
+            events += event['messages'] if event['type'] == 'chat_messages' else [event]
+        return [event['message'] for event in events]
+
+    def test_busy_rooms_are_batched_in_order(self):
+        async def burst(fanout):
+            layer = RecordingLayer()
+            for i in range(100):
+                await fanout.publish(layer, 'lobby', {'type': 'chat_message', 'message': i})
+                if i % 10 == 0:
+                    await asyncio.sleep(0.01)
+            await asyncio.sleep(0.2)
+            return layer.sent
+
+        sent = async_to_sync(burst)(Fanout(tick=0.05, rate=5))
+        self.assertEqual(self.contents(sent), list(range(100)))
+        self.assertEqual([event['type'] for event in sent[:4]], ['chat_message'] * 4)
+        self.assertLess(len(sent), 20)
+
+        sent = async_to_sync(burst)(Fanout(tick=0))
+        self.assertEqual(len(sent), 100)
+
+    def test_every_socket_sees_every_message_in_order(self):
+        user = User.objects.create_user(email='student@example.com', password='x')
+        course = enrolled_course(user)
+
+        async def chat(mode):
+            sockets = [communicator(mode, user, course.id) for _ in range(10)]
+            for socket in sockets:
+                await socket.connect()
+            for i in range(100):
+                await sockets[0].send_json_to({'type': 'single_message', 'message': f'{mode}{i}'})
+            received = []
+            for socket in sockets:
+                contents = []
+                while len(contents) < 100:
+                    contents += [message['content'] for message in (await receive(socket, 'chat_message'))['message']]
+                received.append(contents)
+            for socket in sockets:
+                await socket.disconnect()
+            return received
+
+        for mode in CHAT_CONSUMERS:
+            sends = fanout.group_sends
+            for contents in async_to_sync(chat)(mode):
+                self.assertEqual(contents, [f'{mode}{i}' for i in range(100)])
+            self.assertLess(fanout.group_sends - sends, 100)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'presence', 'OPTIONS': {'MAX_ENTRIES': 10000}}})
+class PresenceTests(ChatTestCase):
+    def test_heartbeats_keep_users_online_across_windows(self):
+        rooms = Presence()
+        with mock.patch('chat.presence.ONLINE_TIMEOUT', 1):
+            for user_id in (1, 2, 3):
+                rooms.join(9, user_id)
+            for _ in range(5):
+                for user_id in (1, 2, 3):
+                    rooms.heartbeat(9, user_id)
+                self.assertEqual(rooms.counts(9)['online'], 3)
+                time.sleep(0.4)
+            rooms.leave(9, 2)
+            rooms.typing(9, 1)
+            self.assertEqual(rooms.counts(9), {'online': 2, 'typing': 1})
+
+            joins = [threading.Thread(target=rooms.join, args=(10, user_id)) for user_id in range(100)]
+            for join in joins:
+                join.start()
+            for join in joins:
+                join.join()
+            self.assertEqual(rooms.counts(10)['online'], 100)
+
+    def test_rooms_get_presence_counts(self):
+        users = [User.objects.create_user(email=f'student{i}@example.com', password='x') for i in range(3)]
+        course = enrolled_course(*users)
+
+        async def updates(socket):
+            await asyncio.sleep(0.5)
+            events = []
+            while not await socket.receive_nothing(timeout=0.1):
+                events.append(await socket.receive_json_from())
+            return [event for event in events if event['type'] == 'presence']
+
+        async def room(mode):
+            watcher = communicator(mode, users[0], course.id)
+            await watcher.connect()
+            tabs = [communicator(mode, user, course.id) for user in (users[1], users[1], users[2])]
+            for tab in tabs:
+                await tab.connect()
+            joined = await updates(watcher)
+            await tabs[2].send_json_to({'type': 'typing'})
+            typing = await updates(watcher)
+            # the user still has another tab open
+            await tabs[1].disconnect()
+            same = await updates(watcher)
+            await tabs[0].disconnect()
+            await tabs[2].disconnect()
+            left = await updates(watcher)
+            await watcher.disconnect()
+            return joined[-1]['online'], typing[-1]['typing'], same, left[-1]['online']
+
+        with mock.patch.object(presence, 'interval', 0.2):
+            for mode in CHAT_CONSUMERS:
+                self.assertEqual(async_to_sync(room)(mode), (3, 1, [], 1))
+
+
+class SearchTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='student@example.com', password='x')
+        self.course = enrolled_course(self.user)
+        self.group_id = chat_group_id(self.course.id)
+        other = ChatGroup.objects.create(group_name='lobby')
+        words = ['alpha', 'beta', 'gamma', 'delta', 'python', 'django']
+        messages = [Message(creator=self.user, chat_group_id=self.group_id,
+                            content=f'{words[i % 6]} {words[i * 7 % 6]} filler {i}') for i in range(2000)]
+        messages += [Message(creator=self.user, chat_group_id=other.id, content='python python') for _ in range(2000)]
+        messages.append(Message(creator=self.user, chat_group_id=self.group_id,
+                                content='needle haystack python python python'))
+        Message.objects.bulk_create(messages, batch_size=1000)
+
+    def test_matches_are_ranked_within_the_room(self):
+        found, more = search_messages(self.group_id, 'python pyth')
+        self.assertTrue(more)
+        self.assertEqual(found[0].content, 'needle haystack python python python')
+        self.assertTrue(all(message.chat_group_id == self.group_id for message in found))
+        self.assertEqual([message.content for message in search_messages(self.group_id, 'needl')[0]],
+                         ['needle haystack python python python'])
+        self.assertEqual(len(search_messages(self.group_id, 'python', page=2, limit=50)[0]), 50)
+        self.assertEqual(search_messages(self.group_id, '" OR * NEAR(')[0], [])
+
+    def test_index_follows_edits_and_deletes(self):
+        message = Message.objects.get(content__startswith='needle')
+        message.content = 'changed'
+        message.save()
+        self.assertEqual(search_messages(self.group_id, 'needle')[0], [])
+        self.assertEqual(len(search_messages(self.group_id, 'changed')[0]), 1)
+        message.delete()
+        self.assertEqual(search_messages(self.group_id, 'changed')[0], [])
+
+    def test_search_view(self):
+        outsider = User.objects.create_user(email='outsider@example.com', password='x')
+        url = f'/chat/room/{self.course.id}/search/'
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(url, {'query': 'python'}).status_code, 403)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url, {'query': 'alpha', 'page': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['message']), 20)
+        self.assertEqual(self.client.get(url, {'query': 'alpha', 'page': 'x'}).status_code, 400)
+        response = self.client.get(url, {'query': 'alpha', 'limit': 999999})
+        self.assertEqual(len(response.json()['message']), MAX_SEARCH_PAGE_SIZE)
+
+    def test_search_over_the_socket(self):
+        async def search(mode):
+            socket = communicator(mode, self.user, self.course.id)
+            await socket.connect()
+            await socket.send_json_to({'type': 'search', 'query': 'delta'})
+            found = await receive(socket, 'search')
+            errors = []
+            for bad in ({'page': 'x'}, {'limit': [1]}, {'page': 10 ** 30}, {'page': -1}):
+                await socket.send_json_to({'type': 'search', 'query': 'delta', **bad})
+                errors.append(await receive(socket, 'error'))
+            await socket.send_json_to({'type': 'search', 'query': 'delta', 'limit': 10 ** 30})
+            capped = await receive(socket, 'search')
+            await socket.disconnect()
+            return found, errors, capped
+
+        for mode in CHAT_CONSUMERS:
+            found, errors, capped = async_to_sync(search)(mode)
+            self.assertEqual(len(found['message']), 20)
+            self.assertEqual({error['request'] for error in errors}, {'search'})
+            self.assertEqual(len(capped['message']), MAX_SEARCH_PAGE_SIZE)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(email='owner@example.com', password='x')
+        self.student = User.objects.create_user(email='student@example.com', password='x')
+        self.course = enrolled_course(self.owner, self.student)
+        self.group_id = chat_group_id(self.course.id)
+        now = timezone.now()
+        Message.objects.bulk_create([
+            Message(creator=self.owner, chat_group_id=self.group_id, content=f'm{i}',
+                    created_at=now - datetime.timedelta(days=200 - i, hours=-1))
+            for i in range(200)])
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = Path(root.name)
+        for name, value in (('ARCHIVE_ROOT', self.root), ('SEGMENT_SIZE', 30)):
+            patcher = mock.patch.object(archive, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def exported(self, data):
+        return [json.loads(line)['content'] for line in gzip.decompress(data).decode().splitlines()]
+
+    def test_old_messages_move_to_segments(self):
+        with self.assertLogs('chat.archive'):
+            call_command('archive_chat', stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 90)
+        self.assertEqual(len(archive.segment_paths(self.group_id)), 4)
+
+        # a segment written just before a crash, its rows never deleted
+        archive.write_segment(self.group_id, list(Message.objects.order_by('created_at')[:5]))
+        chat_group = ChatGroup.objects.get(id=self.group_id)
+        archive.archive_group(chat_group, days=1000)
+        self.assertEqual(Message.objects.count(), 85)
+        self.assertEqual(self.exported(b''.join(archive.export_chunks(self.group_id))),
+                         [f'm{i}' for i in range(200)])
+
+        chat_group.retention_days = 20
+        chat_group.save()
+        with self.assertLogs('chat.archive'):
+            archive.archive_messages()
+        self.assertEqual(Message.objects.count(), 20)
+
+    def test_owners_export_the_whole_room(self):
+        with self.assertLogs('chat.archive'):
+            archive.archive_messages()
+        url = f'/chat/room/{self.course.id}/export/'
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.owner)
+        response = self.client.get(url)
+        self.assertEqual(self.exported(b''.join(response.streaming_content)), [f'm{i}' for i in range(200)])
+
+        path = self.root / 'export.gz'
+        call_command('export_chat', self.course.id, '-o', str(path))
+        self.assertEqual(self.exported(path.read_bytes()), [f'm{i}' for i in range(200)])
+
+
+class LoadChatTests(ChatTestCase):
+    def test_every_message_reaches_its_room(self):
+        command = load_chat.Command()
+        rooms = command.setup_rooms(2, 3)
+        options = {'rate': 20, 'duration': 0.5}
+        report = async_to_sync(command.run)(application, rooms, load_chat.QueryCounter(), options)
+        self.assertEqual(report['sockets'], 6)
+        self.assertGreater(report['messages sent'], 0)
+        self.assertEqual(report['deliveries'], f"{report['messages sent'] * 3} of {report['messages sent'] * 3}")
+
+    def test_needs_daphne(self):
+        with mock.patch('chat.management.commands.load_chat.WebsocketCommunicator', None):
+            with self.assertRaisesMessage(CommandError, 'install requirements/dev.txt'):
+                call_command('load_chat')
+
+
+class BinaryDecoder:
+    """Reads the frames of one binary socket back into events, the way room.html does."""
+
+    def __init__(self):
+        self.creators = {}
+
+    def decode(self, frame):
+        self.frame, self.pos = frame, 1
+        kind = frame[0]
+        if kind == PRESENCE:
+            return {'type': 'presence', 'online': self.int(), 'typing': self.int()}
+        if kind == HISTORY:
+            before_id, has_more = self.int() - 1, bool(self.int())
+            return {'type': 'history', 'before_id': None if before_id < 0 else before_id,
+                    'has_more': has_more, 'message': self.messages()}
+        return {'type': {CHAT_MESSAGE: 'chat_message', ALL_MESSAGE: 'all_message'}[kind],
+                'message': self.messages()}
+
+    def int(self):
+        value = shift = 0
+        while True:
+            byte = self.frame[self.pos]
+            self.pos += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    def text(self):
+        end = self.int() + self.pos
+        value, self.pos = self.frame[self.pos:end].decode(), end
+        return value
+
+    def messages(self):
+        for _ in range(self.int()):
+            ref = self.int()
+            self.creators[ref] = self.text()
+        return [{'message_id': self.int(), 'creator': self.creators[self.int()], 'created_at': self.int(),
+                 'content': self.text()} for _ in range(self.int())]
+
+
+class BinaryProtocolTests(ChatTestCase):
+    def test_varints_and_creator_refs(self):
+        self.assertEqual([varint(value) for value in (0, 127, 128, 300)],
+                         [b'\x00', b'\x7f', b'\x80\x01', b'\xac\x02'])
+        encoder, decoder = BinaryEncoder(), BinaryDecoder()
+        created_at = '2026-01-02T03:04:05.678000+00:00'
+        messages = [{'message_id': 1000 + i, 'creator': f'user{i % 2}@example.com', 'created_at': created_at,
+                     'content': f'héllo {i}'} for i in range(3)]
+        first = encoder.encode({'type': 'chat_message', 'message': messages})
+        again = encoder.encode({'type': 'chat_message', 'message': messages})
+        self.assertLess(len(again), len(first))
+        for frame in (first, again):
+            self.assertEqual([message['content'] for message in decoder.decode(frame)['message']],
+                             ['héllo 0', 'héllo 1', 'héllo 2'])
+        self.assertEqual(decoder.decode(first)['message'][0]['created_at'],
+                         int(datetime.datetime.fromisoformat(created_at).timestamp() * 1000))
+
+    def test_binary_and_json_sockets_get_the_same_messages(self):
+        users = [User.objects.create_user(email=f'student{i}@example.com', password='x') for i in range(2)]
+        course = enrolled_course(*users)
+
+        async def messages(socket, read):
+            received = []
+            while len(received) < 10:
+                event = read(await socket.receive_output(5))
+                if event['type'] == 'chat_message':
+                    received += event['message']
+            return received
+
+        async def chat(mode):
+            binary = communicator(mode, users[0], course.id)
+            binary.scope['subprotocols'] = [BINARY_SUBPROTOCOL]
+            _, subprotocol = await binary.connect()
+            plain = communicator(mode, users[1], course.id)
+            await plain.connect()
+            for i in range(10):
+                await plain.send_json_to({'type': 'single_message', 'message': f'hello number {i}'})
+            decoder = BinaryDecoder()
+            from_binary = await messages(binary, lambda output: decoder.decode(output['bytes']))
+            from_json = await messages(plain, lambda output: json.loads(output['text']))
+            await binary.send_json_to({'type': 'fetch_history', 'limit': 5})
+            while (history := decoder.decode((await binary.receive_output(5))['bytes']))['type'] != 'history':
+                pass
+            await binary.disconnect()
+            await plain.disconnect()
+            return subprotocol, from_binary, from_json, history
+
+        for mode in CHAT_CONSUMERS:
+            subprotocol, from_binary, from_json, history = async_to_sync(chat)(mode)
+            self.assertEqual(subprotocol, BINARY_SUBPROTOCOL)
+            self.assertEqual([(message['message_id'], message['creator'], message['content'], message['created_at'])
+                              for message in from_binary],
+                             [(message['message_id'], message['creator'], message['content'],
+                               int(datetime.datetime.fromisoformat(message['created_at']).timestamp() * 1000))
+                              for message in from_json])
+            self.assertEqual(len(history['message']), 5)
+            self.assertTrue(history['has_more'])
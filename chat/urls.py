@@ -4,7 +4,10 @@ from chat import views
 app_name = 'chat'
 
 urlpatterns = [
-    path('room/<int:course_id>/', views.CourseChatRoom.as_view(), name='course_chat_room')
+    path('room/<int:course_id>/', views.CourseChatRoom.as_view(), name='course_chat_room'),
+    path('room/<int:course_id>/search/', views.ChatSearchView.as_view(), name='course_chat_search'),
+    path('room/<int:course_id>/export/', views.ChatExportView.as_view(), name='course_chat_export'),
+    path('metrics/', views.ChatMetricsView.as_view(), name='chat_metrics'),
 ]
 
 
@@ -1,9 +1,18 @@
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseForbidden
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.shortcuts import render
 from django.views.generic import View
 
-from chat.models import Message
+from chat.archive import export_chunks
+from chat.buffer import message_buffer
+from chat.fanout import fanout
+from chat.membership import chat_group_id
+from chat.models import ChatGroup
+from chat.presence import HEARTBEAT_INTERVAL, TYPING_TIMEOUT
+from chat.recent import last_messages, recent_messages
+from chat.search import search_event, search_params
+from courses.enrollment import course_member_ids
 from courses.models import Course
 
 
@@ -22,25 +31,53 @@ class CourseChatRoom(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         try:
             course = self.request.user.courses_joined.get(id=kwargs['course_id'])
-            chat_room = f"chat_{course.id}"
             # get old messages
-            messages = reversed(Message.objects.filter(chat_group__group_name=chat_room)[:20])
-            old_messages = []
-            for message in messages:
-                old_messages.append({
-                    'type': 'all_message',
-                    'message_id': message.id,
-                    'creator': message.creator.email,
-                    'content': message.content,
-                    'group_name': message.chat_group.id,
-                    'created_at': message.created_at
-                })
+            old_messages = last_messages(chat_group_id(course.id), 20)
         except Course.DoesNotExist:
             return HttpResponseForbidden()
 
-        return render(self.request, self.template_name, {'course': course, 'old_messages': old_messages})
+        return render(self.request, self.template_name, {'course': course, 'old_messages': old_messages,
+                                                          'heartbeat_interval': HEARTBEAT_INTERVAL,
+                                                          'typing_timeout': TYPING_TIMEOUT})
 
 
+class ChatSearchView(LoginRequiredMixin, View):
+    """Ranked search of a course's chat, for its instructor and students: ``?query=...&page=2``."""
 
+    def get(self, request, *args, **kwargs):
+        course = kwargs['course_id']
+        owner_id = Course.objects.filter(id=course).values_list('owner_id', flat=True).first()
+        if owner_id is None or (owner_id != request.user.id and request.user.pk not in course_member_ids(course)):
+            return HttpResponseForbidden()
+        try:
+            params = search_params(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse(search_event(ChatGroup(id=chat_group_id(course)), *params))
 
 
+class ChatExportView(LoginRequiredMixin, View):
+    """Whole chat history of a course, archived and live, streamed as gzip JSON lines."""
+
+    def get(self, request, *args, **kwargs):
+        course = get_object_or_404(Course, id=kwargs['course_id'])
+        if course.owner_id != request.user.id and not request.user.is_staff:
+            return HttpResponseForbidden()
+        response = StreamingHttpResponse(export_chunks(chat_group_id(course.id)), content_type='application/gzip')
+        response['Content-Disposition'] = f'attachment; filename="chat-{course.id}.jsonl.gz"'
+        return response
+
+
+class ChatMetricsView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Write-behind buffer state for monitoring, staff only."""
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({'pending_messages': message_buffer.pending,
+                             'written_messages': message_buffer.flushed,
+                             'resident_rooms': recent_messages.resident,
+                             'room_fills': recent_messages.fills,
+                             'published_messages': fanout.messages,
+                             'group_sends': fanout.group_sends})
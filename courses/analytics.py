@@ -0,0 +1,75 @@
+import datetime
+import logging
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from courses.models import CourseDailyStats
+
+logger = logging.getLogger(__name__)
+
+STAT_FIELDS = ('new_enrollments', 'messages', 'contents_added')
+
+
+def add_daily(deltas):
+    """
+    Add ``{(course_id, day): {field: delta}}`` to the daily rollups, creating
+    the rows that are missing. One INSERT .. ON CONFLICT on SQLite and
+    PostgreSQL, an UPDATE or INSERT per row elsewhere.
+    """
+    if not deltas:
+        return
+    rows = [(course_id, day, *(fields.get(name, 0) for name in STAT_FIELDS))
+            for (course_id, day), fields in deltas.items()]
+    with transaction.atomic():
+        if connection.vendor in ('postgresql', 'sqlite'):
+            qn = connection.ops.quote_name
+            table = qn(CourseDailyStats._meta.db_table)
+            columns = ', '.join(qn(name) for name in ('course_id', 'day', *STAT_FIELDS))
+            values = ', '.join(['(%s, %s' + ', %s' * len(STAT_FIELDS) + ')'] * len(rows))
+            updates = ', '.join(f"{qn(name)} = {table}.{qn(name)} + excluded.{qn(name)}" for name in STAT_FIELDS)
+            params = []
+            for course_id, day, *counts in rows:
+                params += [course_id, connection.ops.adapt_datefield_value(day), *counts]
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {table} ({columns}) VALUES {values} "
+                               f"ON CONFLICT ({qn('course_id')}, {qn('day')}) DO UPDATE SET {updates}", params)
+            return
+        for course_id, day, *counts in rows:
+            stats, _ = CourseDailyStats.objects.get_or_create(course_id=course_id, day=day)
+            CourseDailyStats.objects.filter(pk=stats.pk).update(
+                **{name: F(name) + count for name, count in zip(STAT_FIELDS, counts)})
+
+
+def count_today(field, counts):
+    """Add ``{course_id: n}`` to today's ``field``."""
+    today = timezone.localdate()
+    add_daily({(course_id, today): {field: n} for course_id, n in counts.items() if n})
+
+
+def count_messages(messages):
+    """Add chat messages, given as (course_id, created_at) pairs, to the rollups of their day."""
+    counts = defaultdict(lambda: {'messages': 0})
+    for course_id, created_at in messages:
+        if course_id is not None:
+            counts[course_id, timezone.localdate(created_at)]['messages'] += 1
+    add_daily(counts)
+
+
+def daily_stats(course_id, days, today=None):
+    """
+    One dict per day for the last ``days`` days up to ``today``, oldest
+    first, with zeros for the days without activity. Reads only the
+    rollups, one indexed range query whatever the course's history.
+    """
+    today = today or timezone.localdate()
+    start = today - datetime.timedelta(days=days - 1)
+    stored = {row['day']: row for row in
+              CourseDailyStats.objects.filter(course_id=course_id, day__range=(start, today)).values('day', *STAT_FIELDS)}
+    series = []
+    for offset in range(days):
+        day = start + datetime.timedelta(days=offset)
+        series.append(stored.get(day, {'day': day, **dict.fromkeys(STAT_FIELDS, 0)}))
+    return series
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CourseCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created', '-id')
+
+
+class SubjectCursorPagination(CourseCursorPagination):
+    ordering = ('title', 'id')
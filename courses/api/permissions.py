@@ -1,6 +1,13 @@
 from rest_framework.permissions import BasePermission
 
+from courses.enrollment import is_enrolled
+
 
 class IsEnrolled(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.students.filter(id=request.user.id).exists()
+        return is_enrolled(request.user, obj.id)
+
+
+class IsCourseOwner(BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return obj.owner_id == request.user.id or request.user.is_staff
@@ -3,7 +3,37 @@ from rest_framework import serializers
 from courses.models import Subject, Module, Course, Content
 
 
-class SubjectSerializer(serializers.ModelSerializer):
+def query_param_set(request, name):
+    if request is None:
+        return set()
+    return {value.strip() for value in request.query_params.get(name, '').split(',') if value.strip()}
+
+
+class DynamicFieldsMixin:
+    """
+    ``?fields=id,title`` limits the output to the listed fields.
+    Nested fields in ``Meta.expandable_fields`` are left out of list
+    responses unless asked for with ``?expand=modules``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        view = self.context.get('view')
+
+        if getattr(view, 'action', None) == 'list':
+            expand = query_param_set(request, 'expand')
+            for name in getattr(self.Meta, 'expandable_fields', []):
+                if name not in expand:
+                    self.fields.pop(name, None)
+
+        only = query_param_set(request, 'fields')
+        if only:
+            for name in set(self.fields) - only:
+                self.fields.pop(name)
+
+
+class SubjectSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Subject
         fields = ['id', 'title', 'slug']
@@ -15,12 +45,13 @@ class ModuleSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'description', 'order']
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     modules = ModuleSerializer(many=True, read_only=True)
 
     class Meta:
         model = Course
         fields = ['id', 'title', 'overview', 'subject', 'slug', 'created', 'owner', 'modules']
+        expandable_fields = ['modules']
 
 
 class ItemRelatedField(serializers.RelatedField):
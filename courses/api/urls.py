@@ -22,6 +22,7 @@ app_name = 'courses_api'
 urlpatterns = [
     path('subjects/', views.SubjectListView.as_view(), name='subject_list'),
     path('subjects/<int:pk>/', views.SubjectDetailView.as_view(), name='subject_detail'),
+    path('progress/', views.ProgressListView.as_view(), name='progress_list'),
     # path('courses/<pk>/enroll/', views.CourseEnrollView.as_view(), name='course_enroll'),
     path('', include(router.urls)),
     path('docs/', schema_view.with_ui('swagger', cache_timeout=0))
@@ -1,4 +1,12 @@
+import io
+import json
+
+from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import generics
 from rest_framework import viewsets
 from rest_framework.authentication import BasicAuthentication
@@ -7,15 +15,20 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from courses.api.permissions import IsEnrolled
-from courses.api.serializers import SubjectSerializer, CourseSerializer, CourseWithContentsSerializer
-from courses.models import Course
+from courses.api.permissions import IsCourseOwner, IsEnrolled
+from courses.api.pagination import CourseCursorPagination, SubjectCursorPagination
+from courses.api.serializers import SubjectSerializer, CourseSerializer, CourseWithContentsSerializer, query_param_set
+from courses.enrollment import bulk_enroll, enrolled_course_ids, read_emails
+from courses.fragments import FRAGMENT_TIMEOUT, course_etag, get_course_modified, get_course_version
+from courses.models import Content, Course
 from courses.models import Subject
+from courses.progress import course_progress
 
 
 class SubjectListView(generics.ListAPIView):
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
+    pagination_class = SubjectCursorPagination
 
 
 class SubjectDetailView(generics.RetrieveAPIView):
@@ -23,6 +36,17 @@ class SubjectDetailView(generics.RetrieveAPIView):
     serializer_class = SubjectSerializer
 
 
+class ProgressListView(APIView):
+    """Progress of the user in every course they are enrolled in."""
+    authentication_classes = [BasicAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        courses = list(Course.objects.filter(id__in=enrolled_course_ids(request.user)).only('id', 'title', 'total_contents'))
+        progress = course_progress(request.user, courses)
+        return Response([{'course': course.id, 'title': course.title, **progress[course.id]} for course in courses])
+
+
 # class CourseEnrollView(APIView):
 #     authentication_classes = [BasicAuthentication]
 #     permission_classes = [IsAuthenticated]
@@ -36,6 +60,14 @@ class SubjectDetailView(generics.RetrieveAPIView):
 class CourseViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = CourseSerializer
     queryset = Course.objects.all()
+    pagination_class = CourseCursorPagination
+    contents_prefetch = [Prefetch('modules__contents', queryset=Content.objects.with_items())]
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == 'list' and 'modules' in query_param_set(self.request, 'expand'):
+            qs = qs.prefetch_related('modules')
+        return qs
 
     @action(methods=['post'], detail=True, authentication_classes=[BasicAuthentication],
             permission_classes=[IsAuthenticated])
@@ -44,9 +76,78 @@ class CourseViewSet(viewsets.ReadOnlyModelViewSet):
         course.students.add(request.user)
         return Response({'enrolled': True})
 
+    @action(methods=['post'], detail=True, authentication_classes=[BasicAuthentication],
+            permission_classes=[IsAuthenticated, IsCourseOwner])
+    def enroll_bulk(self, request, *args, **kwargs):
+        """
+        Enroll a roster uploaded as ``file``, CSV or JSON lines (``format=jsonl``
+        or a .jsonl/.ndjson name). Streams one JSON line of running totals per
+        chunk. ``create_missing=false`` skips unknown emails instead of
+        creating accounts for them.
+        """
+        course = self.get_object()
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Upload the roster as "file"'}, status=400)
+        fmt = request.data.get('format') or ('jsonl' if upload.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+        create_missing = str(request.data.get('create_missing', 'true')).lower() != 'false'
+
+        lines = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        progress = bulk_enroll(course, read_emails(lines, fmt), create_missing=create_missing)
+        return StreamingHttpResponse((json.dumps(totals) + '\n' for totals in progress),
+                                     content_type='application/x-ndjson')
+
+    @action(methods=['get'], detail=True, authentication_classes=[BasicAuthentication],
+            permission_classes=[IsAuthenticated, IsEnrolled])
+    def progress(self, request, *args, **kwargs):
+        course = self.get_object()
+        return Response({'course': course.id, **course_progress(request.user, [course])[course.id]})
+
     @action(methods=['get'], detail=True, serializer_class=CourseWithContentsSerializer,
             authentication_classes=[BasicAuthentication], permission_classes=[IsAuthenticated, IsEnrolled])
     def contents(self, request, *args, **kwargs):
-        return self.retrieve(request, *args, **kwargs)
+        course = self.get_object()
+        etag = course_etag(course.id, 'contents')
+        not_modified = self.get_not_modified_response(course.id, etag)
+        if not_modified:
+            return not_modified
+
+        key = f"course_{course.id}_contents_{get_course_version(course.id)}"
+        data = cache.get(key)
+        if data is None:
+            # modules, contents and one query per item model, however big the course is
+            prefetch_related_objects([course], *self.contents_prefetch)
+            data = self.get_serializer(course).data
+            cache.set(key, data, FRAGMENT_TIMEOUT)
+        return self.set_validators(Response(data), course.id, etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        course_id = self.kwargs[self.lookup_field]
+        if not course_id.isdigit():
+            return super().retrieve(request, *args, **kwargs)
+
+        etag = course_etag(course_id, 'detail', request.query_params.urlencode())
+        not_modified = self.get_not_modified_response(course_id, etag)
+        if not_modified:
+            return not_modified
+        return self.set_validators(super().retrieve(request, *args, **kwargs), course_id, etag)
+
+    def get_not_modified_response(self, course_id, etag):
+        response = get_conditional_response(self.request, etag=quote_etag(etag),
+                                            last_modified=self.get_last_modified(course_id))
+        if response is None:
+            return None
+        return self.set_validators(Response(status=response.status_code), course_id, etag)
+
+    def get_last_modified(self, course_id):
+        modified = get_course_modified(course_id)
+        return int(modified.timestamp()) if modified else None
+
+    def set_validators(self, response, course_id, etag):
+        response['ETag'] = quote_etag(etag)
+        last_modified = self.get_last_modified(course_id)
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
 
 
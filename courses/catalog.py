@@ -0,0 +1,71 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from courses.models import Course, Subject
+from courses.versions import bump_version, get_version
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION_KEY = 'catalog_version'
+CATALOG_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    bump_version(CATALOG_VERSION_KEY)
+    logger.debug('Catalog cache version bumped')
+
+
+def catalog_key(name):
+    return f"catalog_{get_catalog_version()}_{name}"
+
+
+def _owner_name(row):
+    return f"{row.pop('owner__first_name')} {row.pop('owner__last_name')}".strip()
+
+
+def _course_rows(queryset):
+    rows = []
+    for row in queryset.values(
+            'id', 'title', 'slug', 'subject_id', 'subject__title', 'subject__slug', 'total_modules',
+            'owner__first_name', 'owner__last_name'):
+        row['subject'] = {'id': row.pop('subject_id'),
+                          'title': row.pop('subject__title'),
+                          'slug': row.pop('subject__slug')}
+        row['owner_name'] = _owner_name(row)
+        rows.append(row)
+    return rows
+
+
+def get_subjects():
+    """Subjects with their course count, as plain dicts."""
+    key = catalog_key('all_subjects')
+    subjects = cache.get(key)
+    if subjects is None:
+        subjects = list(Subject.objects.values('id', 'title', 'slug', 'total_courses'))
+        cache.set(key, subjects, CATALOG_TIMEOUT)
+        logger.info(f"Subjects {key} added to cache")
+    return subjects
+
+
+def get_courses(subject_id=None):
+    """Catalog rows for all courses, or for the courses of one subject."""
+    if subject_id is None:
+        key = catalog_key('all_courses')
+    else:
+        key = catalog_key(f"subject_{subject_id}_courses")
+
+    courses = cache.get(key)
+    if courses is None:
+        qs = Course.objects.order_by('-created')
+        if subject_id is not None:
+            qs = qs.filter(subject_id=subject_id)
+        courses = _course_rows(qs)
+        cache.set(key, courses, CATALOG_TIMEOUT)
+        logger.info(f"Courses {key} added to cache")
+    return courses
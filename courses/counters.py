@@ -0,0 +1,35 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from courses.models import Content, Course, Module, Subject
+
+
+def adjust(model, pk, **deltas):
+    """Atomically add ``deltas`` to the counter columns of one row."""
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def _count(queryset, field):
+    counted = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def actual_counts():
+    """Counter column name -> (model, expression recomputing it from the source rows)."""
+    return {
+        'total_courses': (Subject, _count(Course.objects.all(), 'subject')),
+        'total_modules': (Course, _count(Module.objects.all(), 'course')),
+        'total_contents': (Course, _count(Content.objects.all(), 'module__course')),
+        'total_students': (Course, _count(Course.students.through.objects.all(), 'course')),
+    }
+
+
+def repair_counters(dry_run=False):
+    """Recompute every counter column with one UPDATE each and return how many rows had drifted."""
+    drift = {}
+    for field, (model, expression) in actual_counts().items():
+        drifted = model.objects.alias(actual=expression).filter(~Q(**{field: F('actual')}))
+        drift[field] = drifted.count()
+        if drift[field] and not dry_run:
+            model.objects.update(**{field: expression})
+    return drift
@@ -0,0 +1,144 @@
+import csv
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+
+from courses.models import Course
+
+ENROLL_CHUNK_SIZE = 1000
+ENROLLMENT_TIMEOUT = getattr(settings, 'ENROLLMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def enrollments_key(user_id):
+    return f"enrollments_{user_id}"
+
+
+def members_key(course_id):
+    return f"course_members_{course_id}"
+
+
+def enrolled_course_ids(user):
+    """Ids of the courses ``user`` is enrolled in, cached until their enrollments change."""
+    if not user.is_authenticated:
+        return frozenset()
+    ids = cache.get(enrollments_key(user.pk))
+    if ids is None:
+        ids = frozenset(Course.students.through.objects.filter(user_id=user.pk).values_list('course_id', flat=True))
+        cache.set(enrollments_key(user.pk), ids, ENROLLMENT_TIMEOUT)
+    return ids
+
+
+def course_member_ids(course_id):
+    """Ids of the students of a course, cached until its enrollments change."""
+    ids = cache.get(members_key(course_id))
+    if ids is None:
+        ids = frozenset(Course.students.through.objects.filter(course_id=course_id).values_list('user_id', flat=True))
+        cache.set(members_key(course_id), ids, ENROLLMENT_TIMEOUT)
+    return ids
+
+
+def is_enrolled(user, course_id):
+    return int(course_id) in enrolled_course_ids(user)
+
+
+def forget_enrollments(course_ids, user_ids):
+    keys = [enrollments_key(user_id) for user_id in user_ids] + [members_key(course_id) for course_id in course_ids]
+    cache.delete_many(keys)
+    # a request reading between the change and its commit may have cached the old sets again
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def read_emails(lines, fmt='csv'):
+    """
+    Emails from an iterable of text lines, one at a time. CSV takes the
+    ``email`` column when the header has one and the first column
+    otherwise. JSON lines take strings or objects with an ``email`` key, a
+    line that is not JSON comes out as ``None`` and counts as invalid.
+    """
+    if fmt == 'jsonl':
+        for line in lines:
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield row.get('email') if isinstance(row, dict) else row
+        return
+
+    rows = csv.reader(lines)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = [column.strip().lower() for column in header]
+    if 'email' in columns:
+        column = columns.index('email')
+    else:
+        column = 0
+        rows = (row for chunk in ([header], rows) for row in chunk)
+    for row in rows:
+        if len(row) > column:
+            yield row[column]
+
+
+def bulk_enroll(course, emails, chunk_size=ENROLL_CHUNK_SIZE, create_missing=True):
+    """
+    Enroll ``emails`` in ``course`` ``chunk_size`` at a time and yield the
+    running totals after every chunk, so memory stays flat whatever the
+    roster size. Each chunk is one transaction. It takes one SELECT for the
+    users, one INSERT for missing accounts and their re-SELECT, one SELECT
+    for existing enrollments and one INSERT for the new ones. The usual
+    ``m2m_changed`` signals are sent with just the new students, so
+    counters and caches stay in step as with ``students.add()``.
+    """
+    User = get_user_model()
+    through = Course.students.through
+    totals = {'processed': 0, 'enrolled': 0, 'already_enrolled': 0, 'created': 0, 'invalid': 0, 'unknown': 0}
+    emails = iter(emails)
+
+    while chunk := list(islice(emails, chunk_size)):
+        totals['processed'] += len(chunk)
+        valid = set()
+        for email in chunk:
+            if not isinstance(email, str):
+                totals['invalid'] += 1
+                continue
+            email = User.objects.normalize_email(email.strip())
+            try:
+                validate_email(email)
+            except ValidationError:
+                totals['invalid'] += 1
+                continue
+            valid.add(email)
+
+        with transaction.atomic():
+            users = dict(User.objects.filter(email__in=valid).values_list('email', 'id'))
+            missing = valid - users.keys()
+            if missing and create_missing:
+                User.objects.bulk_create_users(missing)
+                created = dict(User.objects.filter(email__in=missing).values_list('email', 'id'))
+                totals['created'] += len(created)
+                users.update(created)
+            elif missing:
+                totals['unknown'] += len(missing)
+
+            ids = set(users.values())
+            enrolled = set(through.objects.filter(course_id=course.id, user_id__in=ids)
+                           .values_list('user_id', flat=True))
+            new = ids - enrolled
+            totals['already_enrolled'] += len(enrolled)
+            if new:
+                m2m_changed.send(sender=through, action='pre_add', instance=course, reverse=False,
+                                 model=User, pk_set=new, using=through.objects.db)
+                through.objects.bulk_create([through(course_id=course.id, user_id=pk) for pk in new],
+                                            ignore_conflicts=True)
+                m2m_changed.send(sender=through, action='post_add', instance=course, reverse=False,
+                                 model=User, pk_set=new, using=through.objects.db)
+                totals['enrolled'] += len(new)
+        yield dict(totals)
@@ -1,24 +1,147 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.apps import apps
+from django.db import connection, models, transaction
+from django.db.models import F, Max, Value
+from django.db.models.functions import Greatest
 
 
 class OrderField(models.PositiveIntegerField):
-    def __init__(self, for_fields=None, *args, **kwargs):
+    """
+    Position of a row among the rows sharing ``for_fields``.
+
+    New positions come from a per-scope counter row that is incremented
+    atomically, so concurrent inserts never share a value and no sibling
+    query is needed. With ``gap`` > 1 positions are spaced out so a row
+    can be placed between two siblings without renumbering them.
+    """
+
+    def __init__(self, for_fields=None, gap=1, *args, **kwargs):
         self.for_fields = for_fields
+        self.gap = gap
         super().__init__(*args, **kwargs)
 
     def pre_save(self, model_instance, add):
-        if getattr(model_instance, self.attname) is None:
-            try:
-                qs = self.model.objects.all()
-                if self.for_fields:
-                    query = {field: getattr(model_instance, field) for field in self.for_fields}
-                    qs = qs.filter(**query)
-                last_item = qs.latest(self.attname)
-                value = last_item.order + 1
-            except ObjectDoesNotExist:
-                value = 0
+        value = getattr(model_instance, self.attname)
+        if value is None:
+            value = self.allocate(model_instance)
             setattr(model_instance, self.attname, value)
             return value
-        else:
-            return super().pre_save(model_instance, add)
+        if add and not getattr(model_instance, self._allocated_attname, False):
+            self.reserve(model_instance, value)
+        return super().pre_save(model_instance, add)
+
+    def reserve(self, model_instance, value):
+        """Make sure the scope's counter never hands out ``value`` or anything below it again."""
+        scope = self.scope(model_instance)
+        counters = self._counter_model().objects.filter(scope=scope)
+        if not counters.update(value=Greatest(F('value'), Value(value + self.gap))):
+            self._seed(model_instance, scope)
+            counters.update(value=Greatest(F('value'), Value(value + self.gap)))
+
+    @property
+    def _allocated_attname(self):
+        return f"_{self.attname}_allocated"
+
+    def scope(self, model_instance):
+        parts = [self.model._meta.label_lower]
+        for field in self.for_fields or []:
+            attname = model_instance._meta.get_field(field).attname
+            parts.append(f"{attname}={getattr(model_instance, attname)}")
+        return ':'.join(parts)
+
+    def allocate(self, model_instance, count=1):
+        """Reserve ``count`` consecutive positions and return the first one."""
+        scope = self.scope(model_instance)
+        step = count * self.gap
+        value = self._increment(scope, step)
+        if value is None:
+            self._seed(model_instance, scope)
+            value = self._increment(scope, step)
+        return value - step
+
+    def assign(self, objs):
+        """
+        Give every object without a position one and reserve the explicit
+        positions of the others, with one counter update per scope each.
+        """
+        pending = {}
+        explicit = {}
+        for obj in objs:
+            value = getattr(obj, self.attname)
+            if value is None:
+                pending.setdefault(self.scope(obj), []).append(obj)
+                continue
+            scope = self.scope(obj)
+            if scope not in explicit or value > explicit[scope][0]:
+                explicit[scope] = (value, obj)
+            setattr(obj, self._allocated_attname, True)
+
+        for value, obj in explicit.values():
+            self.reserve(obj, value)
+        for scoped in pending.values():
+            first = self.allocate(scoped[0], count=len(scoped))
+            for i, obj in enumerate(scoped):
+                setattr(obj, self.attname, first + i * self.gap)
+                setattr(obj, self._allocated_attname, True)
+
+    def between(self, model_instance, before=None, after=None):
+        """
+        Position for ``model_instance`` between the sibling orders ``before``
+        and ``after``, the middle of the free range. Siblings only move when
+        no free position is left between the two, which with a large ``gap``
+        is rare.
+        """
+        if after is None:
+            return self.allocate(model_instance)
+        lower = -1 if before is None else before
+        if after - lower > 1:
+            return (lower + after + 1) // 2
+
+        # open up room by pushing ``after`` and everything behind it back one gap
+        with transaction.atomic():
+            self._siblings(model_instance).filter(**{f"{self.attname}__gte": after}).update(
+                **{self.attname: F(self.attname) + self.gap})
+            self.reserve(model_instance, after)
+            self._counter_model().objects.filter(scope=self.scope(model_instance)).update(
+                value=F('value') + self.gap)
+        return (lower + after + self.gap + 1) // 2
+
+    def _siblings(self, model_instance):
+        query = {}
+        for field in self.for_fields or []:
+            attname = model_instance._meta.get_field(field).attname
+            query[attname] = getattr(model_instance, attname)
+        return self.model._default_manager.filter(**query)
+
+    def _counter_model(self):
+        return apps.get_model('courses', 'OrderCounter')
+
+    def _seed(self, model_instance, scope):
+        last = self._siblings(model_instance).aggregate(last=Max(self.attname))['last']
+        start = 0 if last is None else last + self.gap
+        self._counter_model().objects.bulk_create([self._counter_model()(scope=scope, value=start)],
+                                                  ignore_conflicts=True)
+
+    def _increment(self, scope, step):
+        counter = self._counter_model()
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            if not counter.objects.filter(scope=scope).update(value=F('value') + step):
+                return None
+            return counter.objects.filter(scope=scope).values_list('value', flat=True).get()
+
+        table = connection.ops.quote_name(counter._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {table} SET value = value + %s WHERE scope = %s RETURNING value",
+                           [step, scope])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+
+class OrderedQuerySet(models.QuerySet):
+    """QuerySet whose ``bulk_create`` allocates contiguous ``OrderField`` ranges."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for field in self.model._meta.concrete_fields:
+            if isinstance(field, OrderField):
+                field.assign(objs)
+        return super().bulk_create(objs, *args, **kwargs)
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from courses.versions import bump_version, get_version
+
+FRAGMENT_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def item_fragment_key(item):
+    return f"item_{item._meta.model_name}_{item.pk}_{item.updated.timestamp()}"
+
+
+def module_version_key(module_id):
+    return f"module_{module_id}_content_version"
+
+
+def get_module_version(module_id):
+    return get_version(module_version_key(module_id))
+
+
+def bump_module_version(*module_ids):
+    for module_id in module_ids:
+        bump_version(module_version_key(module_id))
+
+
+def course_version_key(course_id):
+    return f"course_{course_id}_contents_version"
+
+
+def get_course_version(course_id):
+    return get_version(course_version_key(course_id))
+
+
+def get_course_modified(course_id):
+    return cache.get(f"{course_version_key(course_id)}_modified")
+
+
+def bump_course_version(*course_ids):
+    now = timezone.now()
+    for course_id in course_ids:
+        bump_version(course_version_key(course_id))
+        cache.set(f"{course_version_key(course_id)}_modified", now, timeout=None)
+
+
+def course_etag(course_id, *parts):
+    """ETag for anything built from a course, its modules and contents, without loading them."""
+    return '-'.join(str(part) for part in (course_id, get_course_version(course_id), *parts))
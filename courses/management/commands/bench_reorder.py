@@ -0,0 +1,51 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from courses.models import Content, Course, Module, Subject, Text
+from courses.reorder import bulk_reorder
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ContentOrderView style reorders against the per-row update loop. Rolls back all data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10, 50, 100, 300, 1000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'items':>6} {'mode':>6} {'queries':>8} {'ms':>9}")
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(email='bench-reorder@example.com', password=None)
+            subject = Subject.objects.create(title='Bench', slug='bench-reorder')
+            course = Course.objects.create(owner=user, subject=subject, title='Bench', slug='bench-reorder',
+                                           overview='')
+            for size in options['sizes']:
+                module = Module.objects.create(course=course, title=f"Bench {size}")
+                texts = Text.objects.bulk_create(Text(owner=user, title=str(i), content='') for i in range(size))
+                contents = Content.objects.bulk_create(Content(module=module, item=text) for text in texts)
+                ids = [content.id for content in contents]
+
+                for mode, reorder in (('loop', self.loop_reorder), ('bulk', self.bulk_reorder)):
+                    timings = []
+                    for _ in range(options['repeat']):
+                        random.shuffle(ids)
+                        payload = {str(pk): order for order, pk in enumerate(ids)}
+                        with CaptureQueriesContext(connection) as queries:
+                            start = time.perf_counter()
+                            reorder(user, payload)
+                            timings.append(time.perf_counter() - start)
+                    ms = sorted(timings)[len(timings) // 2] * 1000
+                    self.stdout.write(f"{size:>6} {mode:>6} {len(queries):>8} {ms:>9.2f}")
+            transaction.set_rollback(True)
+
+    def loop_reorder(self, user, payload):
+        for content_id, order in payload.items():
+            Content.objects.filter(id=content_id, module__course__owner=user).update(order=order)
+
+    def bulk_reorder(self, user, payload):
+        bulk_reorder(Content.objects.filter(module__course__owner=user), payload, 'module_id')
@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.enrollment import ENROLL_CHUNK_SIZE, bulk_enroll, read_emails
+from courses.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Enroll a roster of emails, CSV or JSON lines, in a course without loading it into memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id', type=int)
+        parser.add_argument('roster', help="CSV or JSON lines file, '-' for standard input.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Defaults to jsonl for .jsonl/.ndjson files and csv otherwise.')
+        parser.add_argument('--chunk-size', type=int, default=ENROLL_CHUNK_SIZE)
+        parser.add_argument('--no-create', action='store_true', help='Skip emails without an account.')
+
+    def handle(self, *args, **options):
+        course = Course.objects.filter(id=options['course_id']).first()
+        if course is None:
+            raise CommandError(f"Course {options['course_id']} does not exist")
+
+        roster = options['roster']
+        fmt = options['format'] or ('jsonl' if roster.endswith(('.jsonl', '.ndjson')) else 'csv')
+        lines = sys.stdin if roster == '-' else open(roster, encoding='utf-8-sig', newline='')
+        try:
+            totals = {}
+            for totals in bulk_enroll(course, read_emails(lines, fmt), options['chunk_size'],
+                                      create_missing=not options['no_create']):
+                self.stdout.write(' '.join(f"{key}={value}" for key, value in totals.items()))
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+        self.stdout.write(self.style.SUCCESS(f"{totals.get('enrolled', 0)} students enrolled in {course}"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from courses.catalog import bump_catalog_version
+from courses.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized course and subject counters and fix any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted rows.')
+
+    def handle(self, *args, **options):
+        drift = repair_counters(dry_run=options['dry_run'])
+        for field, rows in drift.items():
+            self.stdout.write(f"{field}: {rows} drifted rows")
+
+        if any(drift.values()) and not options['dry_run']:
+            bump_catalog_version()
+            self.stdout.write(self.style.SUCCESS('Counters repaired'))
@@ -0,0 +1,61 @@
+# Generated by Django 5.0 on 2026-10-18 14:32
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count(queryset, field):
+    counted = (
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    Subject = apps.get_model("courses", "Subject")
+    Course = apps.get_model("courses", "Course")
+    Module = apps.get_model("courses", "Module")
+    Content = apps.get_model("courses", "Content")
+
+    Subject.objects.update(total_courses=count(Course.objects.all(), "subject"))
+    Course.objects.update(
+        total_modules=count(Module.objects.all(), "course"),
+        total_contents=count(Content.objects.all(), "module__course"),
+        total_students=count(Course.students.through.objects.all(), "course"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courses", "0003_course_created_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="total_contents",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="total_modules",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="total_students",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="subject",
+            name="total_courses",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
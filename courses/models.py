@@ -1,16 +1,47 @@
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
 from django.conf import settings
 
-from courses.fields import OrderField
+from courses.fields import OrderedQuerySet, OrderField
+from courses.fragments import FRAGMENT_TIMEOUT, item_fragment_key
 from django.template.loader import render_to_string
 
 
-class Subject(models.Model):
+class OrderCounter(models.Model):
+    """Next free ``OrderField`` position for one scope, e.g. the modules of a course."""
+    scope = models.CharField(max_length=255, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.scope}: {self.value}"
+
+
+class CounterModel(models.Model):
+    """
+    Model with denormalized ``counter_fields``. They are only changed by
+    ``F()`` updates, so saving a stale instance never writes them back.
+    """
+    counter_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
+
+class Subject(CounterModel):
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
+    total_courses = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_courses',)
 
     class Meta:
         ordering = ['title']
@@ -19,7 +50,7 @@ class Subject(models.Model):
         return self.title
 
 
-class Course(models.Model):
+class Course(CounterModel):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='courses_created', on_delete=models.CASCADE)
     subject = models.ForeignKey(Subject, related_name='courses', on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
@@ -27,9 +58,15 @@ class Course(models.Model):
     students = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='courses_joined', blank=True)
     overview = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    total_modules = models.PositiveIntegerField(default=0, editable=False)
+    total_contents = models.PositiveIntegerField(default=0, editable=False)
+    total_students = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_modules', 'total_contents', 'total_students')
 
     class Meta:
         ordering = ['-created']
+        indexes = [models.Index(fields=['-created', '-id'])]
 
     def __str__(self):
         return self.title
@@ -41,6 +78,8 @@ class Module(models.Model):
     description = models.TextField(blank=True)
     order = OrderField(blank=True, for_fields=['course'])
 
+    objects = OrderedQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
 
@@ -48,6 +87,12 @@ class Module(models.Model):
         return f"{self.order}.{self.title}"
 
 
+class ContentQuerySet(OrderedQuerySet):
+    def with_items(self):
+        """Load every content item with one query per item model instead of one per row."""
+        return self.prefetch_related('item')
+
+
 class Content(models.Model):
     module = models.ForeignKey(Module, related_name='contents', on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE,
@@ -56,6 +101,8 @@ class Content(models.Model):
     item = GenericForeignKey('content_type', 'object_id')
     order = OrderField(blank=True, for_fields=['module'])
 
+    objects = ContentQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
 
@@ -73,7 +120,12 @@ class ItemBase(models.Model):
         return self.title
 
     def render(self):
-        return render_to_string(f"courses/content/{self._meta.model_name}.html", {'item':self})
+        key = item_fragment_key(self)
+        html = cache.get(key)
+        if html is None:
+            html = render_to_string(f"courses/content/{self._meta.model_name}.html", {'item': self})
+            cache.set(key, html, FRAGMENT_TIMEOUT)
+        return html
 
     def to_json(self):
         return ''
@@ -105,3 +157,44 @@ class Video(ItemBase):
 
     def to_json(self):
         return self.content
+
+
+class CompletionEvent(models.Model):
+    """A student finished a content item. Append-only, written in batches by ``courses.progress``."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='completion_events', on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, related_name='completion_events', on_delete=models.CASCADE)
+    content = models.ForeignKey(Content, related_name='completion_events', on_delete=models.CASCADE)
+    created = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'course'])]
+
+
+class CourseProgress(models.Model):
+    """How many distinct contents of a course a student has completed, rolled up from their events."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='course_progress', on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, related_name='student_progress', on_delete=models.CASCADE)
+    completed_contents = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'course'], name='unique_course_progress')]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.course_id}: {self.completed_contents}"
+
+
+class CourseDailyStats(models.Model):
+    """Activity of a course on one day, added to as it happens by ``courses.analytics``."""
+    course = models.ForeignKey(Course, related_name='daily_stats', on_delete=models.CASCADE)
+    day = models.DateField()
+    new_enrollments = models.PositiveIntegerField(default=0)
+    messages = models.PositiveIntegerField(default=0)
+    contents_added = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+        constraints = [models.UniqueConstraint(fields=['course', 'day'], name='unique_course_day')]
+
+    def __str__(self):
+        return f"{self.course_id} on {self.day}"
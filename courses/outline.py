@@ -0,0 +1,46 @@
+import logging
+
+from django.core.cache import cache
+
+from courses.fragments import FRAGMENT_TIMEOUT, get_course_version
+from courses.models import Content, Course, Module
+
+logger = logging.getLogger(__name__)
+
+
+def outline_key(course_id):
+    return f"course_{course_id}_outline_{get_course_version(course_id)}"
+
+
+def get_course_outline(course_id):
+    """
+    The course title and its modules in order, with the ids and number of
+    contents of each, as plain dicts. Stored under the course version, so any edit
+    to the course, its modules or contents makes the next call rebuild it.
+    Returns None for a course that does not exist.
+    """
+    key = outline_key(course_id)
+    outline = cache.get(key)
+    if outline is None:
+        course = Course.objects.filter(id=course_id).values('id', 'title').first()
+        if course is None:
+            return None
+        modules = list(Module.objects.filter(course_id=course_id).values('id', 'title', 'order'))
+        contents = {module['id']: [] for module in modules}
+        for module_id, content_id in Content.objects.filter(module__course_id=course_id).values_list('module_id', 'id'):
+            contents[module_id].append(content_id)
+        for module in modules:
+            module['contents'] = contents[module['id']]
+            module['total_contents'] = len(module['contents'])
+        course['modules'] = modules
+        outline = course
+        cache.set(key, outline, FRAGMENT_TIMEOUT)
+        logger.debug(f"Course outline {key} added to cache")
+    return outline
+
+
+def find_module(outline, module_id=None):
+    """The outline entry of ``module_id``, or of the first module when it is None."""
+    if module_id is None:
+        return outline['modules'][0] if outline['modules'] else None
+    return next((module for module in outline['modules'] if module['id'] == int(module_id)), None)
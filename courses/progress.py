@@ -0,0 +1,192 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from courses.models import CompletionEvent, Content, CourseProgress
+
+logger = logging.getLogger(__name__)
+
+SEEN_TIMEOUT = getattr(settings, 'PROGRESS_SEEN_TIMEOUT', 60 * 60 * 24)
+# pairs per rollup, keeps the IN lists under SQLite's bound variable limit
+ROLLUP_CHUNK_SIZE = 500
+
+
+def percent_complete(completed, total):
+    return min(100, round(100 * completed / total)) if total else 0
+
+
+def rollup(pairs):
+    """
+    Recount the completed contents of each (user_id, course_id) pair from
+    its events and upsert the ``CourseProgress`` rows: one SELECT and one
+    INSERT .. ON CONFLICT, however many pairs there are. Only writers call
+    this, progress is always read from the aggregates.
+    """
+    if not pairs:
+        return
+    user_ids = {user_id for user_id, course_id in pairs}
+    course_ids = {course_id for user_id, course_id in pairs}
+    counts = {(row['user_id'], row['course_id']): row['completed'] for row in
+              CompletionEvent.objects.filter(user_id__in=user_ids, course_id__in=course_ids)
+              .values('user_id', 'course_id').annotate(completed=Count('content_id', distinct=True))}
+    now = timezone.now()
+    rows = [CourseProgress(user_id=user_id, course_id=course_id, completed_contents=counts.get((user_id, course_id), 0),
+                           updated=now)
+            for user_id, course_id in pairs]
+    CourseProgress.objects.bulk_create(rows, update_conflicts=True, unique_fields=['user', 'course'],
+                                       update_fields=['completed_contents', 'updated'])
+
+
+def rollup_on_commit(pairs):
+    """
+    Roll ``pairs`` up once the current transaction commits, together with
+    every other pair queued in it, so deleting a module or course of many
+    contents recounts each affected student once.
+    """
+    if not pairs:
+        return
+    connection = transaction.get_connection()
+    connection.__dict__.setdefault('_pending_rollups', set()).update(pairs)
+    transaction.on_commit(lambda: _rollup_pending(connection))
+
+
+def _rollup_pending(connection):
+    pairs = sorted(connection.__dict__.pop('_pending_rollups', ()))
+    for start in range(0, len(pairs), ROLLUP_CHUNK_SIZE):
+        chunk = set(pairs[start:start + ROLLUP_CHUNK_SIZE])
+        # the course or the student may have gone in the same transaction
+        rollup(chunk & set(CourseProgress.objects.filter(user_id__in={user_id for user_id, course_id in chunk},
+                                                         course_id__in={course_id for user_id, course_id in chunk})
+                           .values_list('user_id', 'course_id')))
+
+
+class ProgressBuffer:
+    """
+    Write-behind buffer for completion events.
+
+    ``record`` only touches memory. Repeats of the same (user, content)
+    collapse into one pending event. A background thread writes the
+    pending events with one ``bulk_create`` and rolls the touched
+    (user, course) pairs up into ``CourseProgress``, once ``max_size``
+    are waiting or every ``max_delay`` seconds, and again at exit.
+    """
+
+    def __init__(self, max_size=500, max_delay=2.0):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.flushed = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def record(self, user_id, course_id, content_ids):
+        now = timezone.now()
+        with self._lock:
+            for content_id in content_ids:
+                self._pending.setdefault((user_id, content_id), (course_id, now))
+            size = len(self._pending)
+
+        self._start()
+        if size >= self.max_size:
+            self._wake.set()
+
+    def flush(self):
+        """Write every pending event, update the touched aggregates and return how many events were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            events = [CompletionEvent(user_id=user_id, course_id=course_id, content_id=content_id, created=created)
+                      for (user_id, content_id), (course_id, created) in batch.items()]
+            try:
+                try:
+                    self.write(events)
+                except IntegrityError:
+                    # a content or student deleted since it was recorded
+                    events = self.existing(events)
+                    self.write(events)
+            except Exception:
+                logger.exception(f"Could not write {len(batch)} completion events, retrying")
+                with self._lock:
+                    for key, value in batch.items():
+                        self._pending.setdefault(key, value)
+                return 0
+            self.flushed += len(events)
+            logger.debug(f"Wrote {len(events)} completion events")
+            return len(events)
+
+    @staticmethod
+    def write(events):
+        with transaction.atomic():
+            CompletionEvent.objects.bulk_create(events)
+            rollup({(event.user_id, event.course_id) for event in events})
+
+    @staticmethod
+    def existing(events):
+        contents = set(Content.objects.filter(id__in={event.content_id for event in events})
+                       .values_list('id', flat=True))
+        users = set(get_user_model().objects.filter(id__in={event.user_id for event in events})
+                    .values_list('id', flat=True))
+        return [event for event in events if event.content_id in contents and event.user_id in users]
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='progress-flush', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Progress flush thread failed')
+            finally:
+                close_old_connections()
+
+
+progress_buffer = ProgressBuffer(max_size=getattr(settings, 'PROGRESS_FLUSH_SIZE', 500),
+                                 max_delay=getattr(settings, 'PROGRESS_FLUSH_INTERVAL', 2.0))
+
+
+def record_module_view(user, course_id, module, module_version):
+    """
+    Count every content of a module page a student opened as completed.
+    Later views of the same module version record nothing.
+    """
+    if not module['contents']:
+        return
+    if cache.add(f"progress_seen_{user.pk}_{module['id']}_{module_version}", True, SEEN_TIMEOUT):
+        progress_buffer.record(user.pk, course_id, module['contents'])
+
+
+def course_progress(user, courses):
+    """
+    Completed contents and percent for each of ``courses``, keyed by course
+    id, read from the aggregates with one query.
+    """
+    completed = dict(CourseProgress.objects.filter(user_id=user.pk, course_id__in=[course.id for course in courses])
+                     .values_list('course_id', 'completed_contents'))
+    return {course.id: {'completed_contents': completed.get(course.id, 0),
+                        'total_contents': course.total_contents,
+                        'percent': percent_complete(completed.get(course.id, 0), course.total_contents)}
+            for course in courses}
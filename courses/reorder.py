@@ -0,0 +1,68 @@
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+
+
+class ReorderError(ValueError):
+    pass
+
+
+def parse_order_payload(payload):
+    """Turn a drag-and-drop ``{id: order}`` payload into a dict of ints."""
+    if not isinstance(payload, dict) or not payload:
+        raise ReorderError('Expected a non-empty {id: order} object')
+    try:
+        orders = {int(pk): int(order) for pk, order in payload.items()}
+    except (TypeError, ValueError):
+        raise ReorderError('Ids and orders must be integers')
+    if len(orders) != len(payload):
+        raise ReorderError('Duplicate ids in payload')
+    if any(order < 0 for order in orders.values()):
+        raise ReorderError('Orders must be positive')
+    if len(set(orders.values())) != len(orders):
+        raise ReorderError('Duplicate orders in payload')
+    return orders
+
+
+def bulk_reorder(queryset, payload, parent_field):
+    """
+    Apply a whole reorder payload to ``queryset`` in one transaction.
+
+    ``queryset`` must already be limited to the rows the user may edit, so
+    ids outside it are rejected together with payloads that span more than
+    one ``parent_field`` value. Runs one SELECT and one UPDATE whatever the
+    payload size, raises the scope's order counter past the highest posted
+    order and returns the parent id.
+    """
+    orders = parse_order_payload(payload)
+
+    with transaction.atomic():
+        parents = dict(queryset.select_for_update().filter(id__in=orders).order_by().values_list('id', parent_field))
+        if len(parents) != len(orders):
+            raise ReorderError('Unknown or foreign ids in payload')
+        if len(set(parents.values())) != 1:
+            raise ReorderError('All ids must share the same parent')
+        parent = next(iter(parents.values()))
+
+        _update_orders(queryset.model, orders)
+        # or a later insert could be handed a position the payload just took
+        queryset.model._meta.get_field('order').reserve(queryset.model(**{parent_field: parent}),
+                                                         max(orders.values()))
+
+    return parent
+
+
+def _update_orders(model, orders):
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        whens = [When(id=pk, then=Value(order)) for pk, order in orders.items()]
+        model.objects.filter(id__in=orders).update(order=Case(*whens))
+        return
+
+    # UPDATE ... FROM (VALUES ...) joins the payload once instead of evaluating
+    # a CASE with one branch per id for every row
+    table = connection.ops.quote_name(model._meta.db_table)
+    order = connection.ops.quote_name(model._meta.get_field('order').column)
+    rows = ', '.join(['(%s, %s)'] * len(orders))
+    params = [value for pair in orders.items() for value in pair]
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {table} SET {order} = v.column2 FROM (VALUES {rows}) AS v "
+                       f"WHERE {table}.id = v.column1", params)
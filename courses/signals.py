@@ -0,0 +1,178 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from courses.analytics import count_today
+from courses.catalog import bump_catalog_version
+from courses.counters import adjust
+from courses.enrollment import forget_enrollments
+from courses.fragments import bump_course_version, bump_module_version
+from courses.models import CompletionEvent, Content, Course, File, Image, Module, Subject, Text, Video
+from courses.progress import rollup_on_commit
+
+
+# counters are connected before the cache invalidation below, so a cache
+# refill triggered by the bump already reads the new counts
+
+@receiver(pre_save, sender=Course)
+def remember_course_subject(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._old_subject_id = Course.objects.filter(pk=instance.pk).values_list('subject_id', flat=True).first()
+
+
+@receiver(post_save, sender=Course)
+def count_course(sender, instance, created, **kwargs):
+    old_subject_id = getattr(instance, '_old_subject_id', None)
+    if created:
+        adjust(Subject, instance.subject_id, total_courses=1)
+    elif old_subject_id is not None and old_subject_id != instance.subject_id:
+        adjust(Subject, old_subject_id, total_courses=-1)
+        adjust(Subject, instance.subject_id, total_courses=1)
+
+
+@receiver(post_delete, sender=Course)
+def uncount_course(sender, instance, **kwargs):
+    adjust(Subject, instance.subject_id, total_courses=-1)
+
+
+@receiver(post_save, sender=Module)
+def count_module(sender, instance, created, **kwargs):
+    if created:
+        adjust(Course, instance.course_id, total_modules=1)
+
+
+@receiver(post_delete, sender=Module)
+def uncount_module(sender, instance, **kwargs):
+    adjust(Course, instance.course_id, total_modules=-1)
+
+
+@receiver(post_save, sender=Content)
+def count_content(sender, instance, created, **kwargs):
+    if created:
+        adjust(Course, instance.module.course_id, total_contents=1)
+
+
+@receiver(post_delete, sender=Content)
+def uncount_content(sender, instance, **kwargs):
+    course_id = Module.objects.filter(id=instance.module_id).values_list('course_id', flat=True).first()
+    if course_id is not None:
+        adjust(Course, course_id, total_contents=-1)
+
+
+@receiver(pre_delete, sender=Content)
+def recount_progress(sender, instance, **kwargs):
+    # the content's completion events go with it, only the students who had one need a recount
+    rollup_on_commit(set(CompletionEvent.objects.filter(content_id=instance.pk).values_list('user_id', 'course_id')))
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def count_students(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_remove':
+        # remove() reports every requested id, including ones that were never enrolled
+        if reverse:
+            rows = sender.objects.filter(user_id=instance.pk, course_id__in=pk_set).values_list('course_id', flat=True)
+        else:
+            rows = sender.objects.filter(course_id=instance.pk, user_id__in=pk_set).values_list('user_id', flat=True)
+        instance._removed_ids = set(rows)
+    elif action == 'pre_clear' and reverse:
+        instance._removed_ids = set(instance.courses_joined.values_list('id', flat=True))
+    elif action == 'post_clear' and not reverse:
+        Course.objects.filter(pk=instance.pk).update(total_students=0)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        ids = pk_set if action == 'post_add' else instance.__dict__.pop('_removed_ids', set())
+        step = 1 if action == 'post_add' else -1
+        if not ids:
+            return
+        if reverse:
+            Course.objects.filter(pk__in=ids).update(total_students=F('total_students') + step)
+        else:
+            adjust(Course, instance.pk, total_students=step * len(ids))
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def invalidate_enrollments(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.courses_joined if reverse else instance.students
+        instance._enrollment_cleared_ids = set(related.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_enrollment_cleared_ids', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        forget_enrollments(pk_set, [instance.pk])
+    else:
+        forget_enrollments([instance.pk], pk_set)
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def record_enrollments(sender, instance, action, reverse, pk_set, **kwargs):
+    # post_add only reports the ids that were not enrolled yet
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        count_today('new_enrollments', dict.fromkeys(pk_set, 1))
+    else:
+        count_today('new_enrollments', {instance.pk: len(pk_set)})
+
+
+@receiver(post_save, sender=Content)
+def record_content(sender, instance, created, **kwargs):
+    if created:
+        count_today('contents_added', {instance.module.course_id: 1})
+
+
+@receiver([post_save, post_delete], sender=Subject)
+@receiver([post_save, post_delete], sender=Course)
+@receiver([post_save, post_delete], sender=Module)
+def invalidate_catalog(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_owner_catalog(sender, instance, created, update_fields=None, **kwargs):
+    # catalog rows carry the owner's name, logins only touch last_login
+    if created or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    if instance.courses_created.exists():
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=Subject)
+def invalidate_subject_courses(sender, instance, created, **kwargs):
+    if not created:
+        bump_course_version(*instance.courses.values_list('id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Course)
+def invalidate_course(sender, instance, **kwargs):
+    bump_course_version(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Module)
+def invalidate_module_course(sender, instance, **kwargs):
+    bump_course_version(instance.course_id)
+
+
+@receiver([post_save, post_delete], sender=Content)
+def invalidate_content_course(sender, instance, **kwargs):
+    bump_module_version(instance.module_id)
+    course_id = Module.objects.filter(id=instance.module_id).values_list('course_id', flat=True).first()
+    if course_id is not None:
+        bump_course_version(course_id)
+
+
+@receiver(post_save, sender=Text)
+@receiver(post_save, sender=File)
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=Video)
+def invalidate_item_course(sender, instance, created, **kwargs):
+    if created:
+        # not attached to a module yet, the Content row will invalidate
+        return
+    modules = Content.objects.filter(content_type=ContentType.objects.get_for_model(sender),
+                                     object_id=instance.id).values_list('module_id', 'module__course_id')
+    bump_module_version(*{module_id for module_id, course_id in modules})
+    bump_course_version(*{course_id for module_id, course_id in modules})
@@ -1,3 +1,636 @@
-from django.test import TestCase
+import base64
+import datetime
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from chat.buffer import MessageBuffer
+from chat.membership import chat_group_id, join_course_chat
+from chat.models import ChatGroup
+from courses.analytics import add_daily
+from courses.catalog import get_catalog_version
+from courses.enrollment import bulk_enroll, read_emails
+from courses.fields import OrderField
+from courses.models import (CompletionEvent, Content, Course, CourseDailyStats, CourseProgress, Module, OrderCounter,
+                            Subject, Text, Video)
+from courses.progress import ProgressBuffer, progress_buffer, rollup
+from courses.reorder import bulk_reorder
+
+
+def query_count(client, url):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200, (url, response.status_code)
+    return len(queries)
+
+
+def basic_auth(email, password='x'):
+    return {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(f'{email}:{password}'.encode()).decode()}
+
+
+class StudentPageTestCase(TestCase):
+    """Student pages record progress from a background thread, these tests leave it out."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(progress_buffer, 'record')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(email='owner@example.com', password='x', first_name='Ann',
+                                              last_name='Lee')
+        self.subject = Subject.objects.create(title='Math', slug='math')
+        self.course = Course.objects.create(owner=self.owner, subject=self.subject, title='Algebra', slug='algebra',
+                                            overview='o')
+        Module.objects.create(course=self.course, title='m1')
+
+    def test_hits_run_no_queries(self):
+        response = self.client.get(reverse('course_list'))
+        self.assertContains(response, 'Ann Lee')
+        self.assertContains(response, '1 modules')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('course_list'))
+        self.client.get(reverse('course_list_subject', args=['math']))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('course_list_subject', args=['math']))
+
+    def test_module_change_invalidates(self):
+        self.client.get(reverse('course_list_subject', args=['math']))
+        Module.objects.create(course=self.course, title='m2')
+        self.assertContains(self.client.get(reverse('course_list_subject', args=['math'])), '2 modules')
+
+    def test_unknown_subject(self):
+        self.assertEqual(self.client.get(reverse('course_list_subject', args=['nope'])).status_code, 404)
+
+    def test_owner_rename_invalidates(self):
+        self.assertContains(self.client.get(reverse('course_list_subject', args=['math'])), 'Ann Lee')
+        self.owner.first_name = 'Bea'
+        self.owner.save()
+        self.assertContains(self.client.get(reverse('course_list_subject', args=['math'])), 'Bea Lee')
+
+    def test_login_keeps_catalog(self):
+        version = get_catalog_version()
+        self.client.login(email='owner@example.com', password='x')
+        self.assertEqual(get_catalog_version(), version)
+
+
+class ContentItemLoadingTests(StudentPageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='student@example.com', password='x')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = Course.objects.create(owner=self.user, subject=subject, title='Algebra', slug='algebra',
+                                            overview='o')
+        self.course.students.add(self.user)
+        self.client.login(email='student@example.com', password='x')
+
+    def module_with(self, count):
+        module = Module.objects.create(course=self.course, title=f'm{count}')
+        for i in range(count):
+            Content.objects.create(module=module, item=Text.objects.create(owner=self.user, title=f't{i}',
+                                                                           content='hello'))
+            Content.objects.create(module=module, item=Video.objects.create(
+                owner=self.user, title=f'v{i}', content='https://www.youtube.com/watch?v=abc'))
+        return module
+
+    def test_queries_do_not_grow_with_contents(self):
+        small, big = self.module_with(2), self.module_with(30)
+        for url in ('/students/course/{course}/{module}/', '/course/module/{module}/'):
+            self.client.get(url.format(course=self.course.id, module=small.id))
+            self.client.get(url.format(course=self.course.id, module=big.id))
+            self.assertEqual(query_count(self.client, url.format(course=self.course.id, module=small.id)),
+                             query_count(self.client, url.format(course=self.course.id, module=big.id)), url)
+
+
+class FragmentCacheTests(StudentPageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='owner@example.com', password='x')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = Course.objects.create(owner=self.user, subject=subject, title='Algebra', slug='algebra',
+                                            overview='o')
+        self.course.students.add(self.user)
+        self.module = Module.objects.create(course=self.course, title='m')
+        self.text = Text.objects.create(owner=self.user, title='t', content='hello')
+        self.content = Content.objects.create(module=self.module, item=self.text)
+        self.url = f'/students/course/{self.course.id}/{self.module.id}/'
+        self.client.login(email='owner@example.com', password='x')
+
+    def test_cached_page_runs_fewer_queries(self):
+        first = query_count(self.client, self.url)
+        self.assertLess(query_count(self.client, self.url), first)
+        self.assertContains(self.client.get(self.url), 'hello')
+
+    def test_views_invalidate(self):
+        self.client.get(self.url)
+        response = self.client.post(f'/course/module/{self.module.id}/content/text/{self.text.id}/',
+                                    {'title': 't', 'content': 'bye'})
+        self.assertEqual(response.status_code, 302)
+        self.assertContains(self.client.get(self.url), 'bye')
+
+        second = Content.objects.create(module=self.module,
+                                        item=Text.objects.create(owner=self.user, title='t2', content='zebra'))
+        self.client.post('/course/content/order/', data={str(second.id): 0, str(self.content.id): 1},
+                         content_type='application/json')
+        body = self.client.get(self.url).content.decode()
+        self.assertLess(body.index('zebra'), body.index('bye'))
+
+        self.client.post(f'/course/content/{second.id}/delete/')
+        self.assertNotContains(self.client.get(self.url), 'zebra')
+
+    def test_changes_outside_views_invalidate(self):
+        self.client.get(self.url)
+        self.text.content = 'changed'
+        self.text.save()
+        self.assertContains(self.client.get(self.url), 'changed')
+
+        other = Content.objects.create(module=self.module,
+                                       item=Text.objects.create(owner=self.user, title='t2', content='added'))
+        self.assertContains(self.client.get(self.url), 'added')
+        other.delete()
+        self.assertNotContains(self.client.get(self.url), 'added')
+
+
+class ReorderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='x')
+        other = User.objects.create_user(email='other@example.com', password='x')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = Course.objects.create(owner=self.user, subject=subject, title='Algebra', slug='algebra',
+                                            overview='o')
+        foreign = Course.objects.create(owner=other, subject=subject, title='Other', slug='other', overview='o')
+        self.modules = [Module.objects.create(course=self.course, title=f'm{i}').id for i in range(3)]
+        self.foreign_module = Module.objects.create(course=foreign, title='f').id
+        self.client.login(email='owner@example.com', password='x')
+
+    def post(self, data):
+        return self.client.post('/course/module/order/', data=data, content_type='application/json')
+
+    def test_one_statement_for_the_whole_payload(self):
+        first, second, third = self.modules
+        # session user, savepoint, select, update, order counter, release
+        with self.assertNumQueries(6):
+            response = self.post({str(first): 2, str(second): 0, str(third): 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Module.objects.filter(course=self.course).values_list('id', flat=True)),
+                         [second, third, first])
+
+    def test_rejects_foreign_ids_and_duplicate_orders(self):
+        self.assertEqual(self.post({str(self.modules[0]): 0, str(self.foreign_module): 1}).status_code, 400)
+        self.assertEqual(self.post({str(self.modules[0]): 0, str(self.modules[1]): 0}).status_code, 400)
+        self.assertEqual(self.post({'x': 0}).status_code, 400)
+        self.assertEqual(list(Module.objects.filter(course=self.course).values_list('id', flat=True)), self.modules)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_reorder', sizes=[10], repeat=1, stdout=out)
+        self.assertIn('items', out.getvalue())
+
+
+class OrderFieldTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='owner@example.com', password='x')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = Course.objects.create(owner=user, subject=subject, title='Algebra', slug='algebra',
+                                            overview='o')
+
+    def orders(self):
+        return list(Module.objects.filter(course=self.course).values_list('order', flat=True))
+
+    def test_allocates_from_the_counter(self):
+        first = Module.objects.create(course=self.course, title='a')
+        # counter update, insert, course counter
+        with self.assertNumQueries(3):
+            second = Module.objects.create(course=self.course, title='b')
+        self.assertEqual((first.order, second.order), (0, 1))
+        Module.objects.create(course=self.course, title='x', order=5)
+        self.assertEqual(Module.objects.create(course=self.course, title='c').order, 6)
+
+    def test_bulk_create_takes_one_range(self):
+        Module.objects.create(course=self.course, title='a')
+        with self.assertNumQueries(2):
+            modules = Module.objects.bulk_create([Module(course=self.course, title=str(i)) for i in range(5)])
+        self.assertEqual([module.order for module in modules], [1, 2, 3, 4, 5])
+
+    def test_bulk_create_reserves_explicit_orders_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            Module.objects.bulk_create([Module(course=self.course, title=f'm{i}', order=i) for i in range(50)])
+        self.assertLessEqual(len(queries), 5)
+        self.assertEqual(Module.objects.create(course=self.course, title='next').order, 50)
+        Module.objects.bulk_create([Module(course=self.course, title='x', order=80),
+                                    Module(course=self.course, title='y')])
+        self.assertEqual(Module.objects.get(title='y').order, 81)
+
+    def test_seeds_a_missing_counter(self):
+        Module.objects.bulk_create([Module(course=self.course, title='a', order=3)])
+        OrderCounter.objects.all().delete()
+        self.assertEqual(Module.objects.create(course=self.course, title='z').order, 4)
+
+    def test_between_renumbers_only_without_room(self):
+        field = Module._meta.get_field('order')
+        for i in range(3):
+            Module.objects.create(course=self.course, title=str(i))
+        module = Module(course=self.course, title='x')
+        self.assertEqual(field.between(module, 0, 1), 1)
+        self.assertEqual(self.orders(), [0, 2, 3])
+        module.order = 1
+        module.save()
+        self.assertEqual(Module.objects.create(course=self.course, title='y').order, 4)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(field.between(module, 0, 4), 2)
+
+    def test_gapped_positions(self):
+        gapped = OrderField(for_fields=['course'], gap=10)
+        gapped.set_attributes_from_name('order')
+        gapped.model = Module
+        Module.objects.create(course=self.course, title='a')
+        self.assertEqual(gapped.allocate(Module(course=self.course)), 1)
+        self.assertEqual(gapped.allocate(Module(course=self.course)), 11)
+        with self.assertNumQueries(0):
+            self.assertEqual(gapped.between(Module(course=self.course), 1, 11), 6)
+
+    def test_reorder_raises_the_counter(self):
+        modules = [Module.objects.create(course=self.course, title=str(i)) for i in range(3)]
+        bulk_reorder(Module.objects.all(), {str(module.id): i * 100 for i, module in enumerate(modules)},
+                     'course_id')
+        self.assertEqual(Module.objects.create(course=self.course, title='z').order, 201)
+
+
+class CourseContentsApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='student@example.com', password='x')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = Course.objects.create(owner=self.user, subject=subject, title='Algebra', slug='algebra',
+                                            overview='o')
+        self.course.students.add(self.user)
+        for i in range(5):
+            module = Module.objects.create(course=self.course, title=f'm{i}')
+            for j in range(10):
+                Content.objects.create(module=module, item=Text.objects.create(owner=self.user, title='t',
+                                                                               content=f'c{i}{j}'))
+        self.url = f'/api/v1/courses/{self.course.id}/contents/'
+
+    def get(self):
+        response = self.client.get(self.url, **basic_auth('student@example.com'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cached_payload(self):
+        payload = self.get()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(), payload)
+        self.assertLess(len(queries), 5)
+
+    def test_edits_and_reorders_invalidate(self):
+        self.get()
+        text = Text.objects.get(content='c00')
+        text.content = 'edited'
+        text.save()
+        self.assertEqual(self.get()['modules'][0]['contents'][0]['item'], 'edited')
+
+        self.client.login(email='student@example.com', password='x')
+        modules = list(Module.objects.filter(course=self.course))
+        self.client.post('/course/module/order/', data={str(m.id): 4 - i for i, m in enumerate(modules)},
+                         content_type='application/json')
+        self.assertEqual(self.get()['modules'][0]['title'], 'm4')
+
+
+class CourseApiPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(email='owner@example.com', password='x')
+        subject = Subject.objects.create(title='Math', slug='math')
+        for i in range(45):
+            course = Course.objects.create(owner=user, subject=subject, title=f'c{i}', slug=f'c{i}', overview='o')
+            Module.objects.create(course=course, title='m')
+        self.last = course
+
+    def test_cursor_pages_cover_every_course_once(self):
+        page = self.client.get('/api/v1/courses/').json()
+        self.assertEqual(len(page['results']), 20)
+        self.assertNotIn('modules', page['results'][0])
+        seen = [course['id'] for course in page['results']]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            seen += [course['id'] for course in page['results']]
+        self.assertEqual(len(seen), 45)
+        self.assertEqual(len(set(seen)), 45)
+
+    def test_fields_and_expand(self):
+        page = self.client.get('/api/v1/courses/?expand=modules&fields=id,modules&page_size=5').json()
+        self.assertEqual(len(page['results']), 5)
+        self.assertEqual(set(page['results'][0]), {'id', 'modules'})
+        self.assertIn('modules', self.client.get(f'/api/v1/courses/{self.last.id}/').json())
+        subjects = self.client.get('/api/v1/subjects/?fields=slug').json()
+        subjects = subjects.get('results', subjects)
+        self.assertEqual(set(subjects[0]), {'slug'})
+
+
+class ConditionalGetTests(StudentPageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='student@example.com', password='x')
+        subject = Subject.objects.create(title='Math', slug='math')
+        self.course = Course.objects.create(owner=self.user, subject=subject, title='Algebra', slug='algebra',
+                                            overview='o')
+        self.module = Module.objects.create(course=self.course, title='m')
+        Content.objects.create(module=self.module, item=Text.objects.create(owner=self.user, title='t', content='c'))
+
+    def etag(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], **extra).status_code, 304, url)
+        return response['ETag']
+
+    def test_not_modified(self):
+        self.client.login(email='student@example.com', password='x')
+        detail = self.etag('/course/algebra/')
+        self.course.students.add(self.user)
+        self.assertEqual(self.client.get('/course/algebra/', HTTP_IF_NONE_MATCH=detail).status_code, 200)
+        self.etag(f'/students/course/{self.course.id}/{self.module.id}/')
+        self.etag(f'/api/v1/courses/{self.course.id}/')
+
+        contents = self.etag(f'/api/v1/courses/{self.course.id}/contents/', **basic_auth('student@example.com'))
+        text = Text.objects.get()
+        text.content = 'changed'
+        text.save()
+        self.assertEqual(self.client.get(f'/api/v1/courses/{self.course.id}/contents/', HTTP_IF_NONE_MATCH=contents,
+                                         **basic_auth('student@example.com')).status_code, 200)
+
+    def test_no_304_for_pages_the_user_may_not_see(self):
+        User.objects.create_user(email='other@example.com', password='x')
+        self.client.login(email='other@example.com', password='x')
+        response = self.client.get(f'/students/course/{self.course.id}/{self.module.id}/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+    def test_detail_etag_follows_the_csrf_secret(self):
+        client = Client(enforce_csrf_checks=True)
+
+        def login():
+            token = client.get('/accounts/login/').context['csrf_token']
+            client.post('/accounts/login/', {'username': 'student@example.com', 'password': 'x',
+                                             'csrfmiddlewaretoken': str(token)})
+
+        login()
+        etag = client.get('/course/algebra/')['ETag']
+        self.assertEqual(client.get('/course/algebra/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        client.get('/accounts/logout/')
+        login()
+        response = client.get('/course/algebra/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class CounterColumnTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', password='x')
+        self.other = User.objects.create_user(email='other@example.com', password='x')
+        self.subject = Subject.objects.create(title='Math', slug='math')
+        self.course = Course.objects.create(owner=self.user, subject=self.subject, title='Algebra', slug='algebra',
+                                            overview='o')
+        self.module = Module.objects.create(course=self.course, title='m')
+        Module.objects.create(course=self.course, title='m2')
+        Content.objects.create(module=self.module, item=Text.objects.create(owner=self.user, title='t', content='c'))
+
+    def counts(self):
+        self.course.refresh_from_db()
+        self.subject.refresh_from_db()
+        return (self.course.total_modules, self.course.total_contents, self.course.total_students,
+                self.subject.total_courses)
+
+    def test_counters_follow_changes(self):
+        self.course.students.add(self.user, self.other)
+        self.course.students.remove(self.other, 999)
+        self.other.courses_joined.add(self.course)
+        self.other.courses_joined.clear()
+        self.course.title = 'Algebra 2'
+        self.course.save()
+        self.assertEqual(self.counts(), (2, 1, 1, 1))
+
+        physics = Subject.objects.create(title='Physics', slug='physics')
+        self.course.subject = physics
+        self.course.save()
+        physics.refresh_from_db()
+        self.assertEqual((self.counts()[3], physics.total_courses), (0, 1))
+
+        self.module.delete()
+        self.assertEqual(self.counts()[:2], (1, 0))
+        self.course.delete()
+        physics.refresh_from_db()
+        self.assertEqual(physics.total_courses, 0)
+
+    def test_repair_command(self):
+        Course.objects.update(total_modules=7)
+        call_command('repair_counters', stdout=StringIO())
+        self.assertEqual(self.counts()[0], 2)
+        self.assertContains(self.client.get('/'), '2 modules')
+
+
+class BulkEnrollTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(email='owner@example.com', password='x')
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        self.course = Course.objects.create(owner=self.owner, subject=subject, title='Course', slug='course',
+                                            overview='o')
+
+    def test_command_enrolls_a_csv_in_chunks(self):
+        student = User.objects.create_user(email='student0@uni.edu', password='x')
+        self.course.students.add(student)
+        waiting = User.objects.create_user(email='student1@uni.edu', password='x')
+        self.assertEqual(join_course_chat(waiting, self.course.id), 0)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as roster:
+            roster.write('name,email\n')
+            roster.writelines(f'Student {i},student{i}@UNI.edu\n' for i in range(500))
+            roster.write('bad,not-an-email\n')
+            roster.flush()
+            call_command('enroll_students', self.course.id, roster.name, '--chunk-size', '100', stdout=StringIO())
+            self.course.refresh_from_db()
+            self.assertEqual(self.course.total_students, 500)
+            self.assertEqual(User.objects.count(), 501)
+            self.assertFalse(User.objects.get(email='student5@uni.edu').has_usable_password())
+            # the cached refusal went with the enrollment
+            self.assertTrue(join_course_chat(waiting, self.course.id))
+
+            out = StringIO()
+            call_command('enroll_students', self.course.id, roster.name, stdout=out)
+            self.assertIn('enrolled=0', out.getvalue())
+
+    def test_api_streams_progress_to_the_owner(self):
+        body = ''.join(json.dumps({'email': f'student{i}@example.org'}) + '\n' for i in range(30))
+        body += '"last@example.org"\n'
+        url = f'/api/v1/courses/{self.course.id}/enroll_bulk/'
+        response = self.client.post(url, {'file': SimpleUploadedFile('roster.jsonl', body.encode())},
+                                    **basic_auth('owner@example.com'))
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(lines[-1]['enrolled'], 31)
+
+        User.objects.create_user(email='student@example.com', password='x')
+        response = self.client.post(url, {'file': SimpleUploadedFile('roster.csv', b'email\na@b.co\n')},
+                                    **basic_auth('student@example.com'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_bad_rows_are_counted_as_invalid(self):
+        self.assertEqual(list(read_emails(['a@b.c\n', 'd@e.f\n'])), ['a@b.c', 'd@e.f'])
+        lines = ['{"email": null}\n', 'not json\n', '5\n', '[1]\n', '"a@x.io"\n', '{"email": "b@x.io"}\n', '{}\n',
+                 '\n']
+        *_, totals = bulk_enroll(self.course, read_emails(lines, 'jsonl'), chunk_size=3)
+        self.assertEqual((totals['processed'], totals['invalid'], totals['enrolled']), (7, 5, 2))
+
+
+class ProgressTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        # a buffer of the test's own, flushed by the test instead of a thread
+        patcher = mock.patch('courses.progress.progress_buffer', ProgressBuffer())
+        self.buffer = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(ProgressBuffer, '_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.student = User.objects.create_user(email='student@example.com', password='x')
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        self.course = Course.objects.create(owner=self.student, subject=subject, title='Course', slug='course',
+                                            overview='o')
+        self.modules = [Module.objects.create(course=self.course, title=f'Module {i}', description='d')
+                        for i in range(2)]
+        self.contents = [Content.objects.create(module=module, item=Text.objects.create(
+            owner=self.student, title=f'Text {i}', content=f'body{i}')) for module in self.modules for i in range(2)]
+        self.course.students.add(self.student)
+        self.client.login(email='student@example.com', password='x')
+
+    def test_views_are_buffered_and_rolled_up(self):
+        url = f'/students/course/{self.course.id}/{self.modules[0].id}/'
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+            self.client.get(url)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'completion' in query['sql'] or 'progress' in query['sql']])
+        self.assertEqual(self.buffer.pending, 2)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(CourseProgress.objects.get().completed_contents, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get('/students/courses/'), '50%')
+        self.assertFalse([query for query in queries.captured_queries if 'completionevent' in query['sql']])
+        response = self.client.get(f'/api/v1/courses/{self.course.id}/progress/', **basic_auth('student@example.com'))
+        self.assertEqual(response.json(), {'course': self.course.id, 'completed_contents': 2, 'total_contents': 4,
+                                           'percent': 50})
+        User.objects.create_user(email='outsider@example.com', password='x')
+        self.assertEqual(self.client.get(f'/api/v1/courses/{self.course.id}/progress/',
+                                         **basic_auth('outsider@example.com')).status_code, 403)
+
+    def test_repeats_and_deleted_contents(self):
+        self.client.get(f'/students/course/{self.course.id}/{self.modules[1].id}/')
+        self.buffer.record(self.student.id, self.course.id, [self.contents[0].id])
+        self.buffer.record(self.student.id, self.course.id, [self.contents[0].id])
+        self.buffer.flush()
+        self.assertEqual(CourseProgress.objects.get().completed_contents, 3)
+        self.contents[3].delete()
+        self.assertEqual(CourseProgress.objects.get().completed_contents, 2)
+
+        self.buffer.record(self.student.id, self.course.id, [self.contents[1].id, 999999])
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(CourseProgress.objects.get().completed_contents, 3)
+
+
+class ProgressRecountTests(TestCase):
+    def test_deleting_a_module_recounts_in_one_statement(self):
+        owner = User.objects.create_user(email='owner@example.com', password='x')
+        students = [User.objects.create_user(email=f'student{i}@example.com', password='x') for i in range(3)]
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        course = Course.objects.create(owner=owner, subject=subject, title='Course', slug='course', overview='o')
+        modules = [Module.objects.create(course=course, title=f'Module {i}', description='d') for i in range(2)]
+        contents = [Content.objects.create(module=module, item=Text.objects.create(owner=owner, title='t', content='x'))
+                    for module in modules for _ in range(20)]
+        CompletionEvent.objects.bulk_create([CompletionEvent(user=student, course=course, content=content,
+                                                             created=timezone.now())
+                                             for student in students[:2] for content in contents])
+        rollup({(student.id, course.id) for student in students})
+        self.assertEqual(CourseProgress.objects.get(user=students[0]).completed_contents, 40)
+
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                modules[0].delete()
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'INSERT INTO "courses_courseprogress"' in query['sql']]), 1)
+        self.assertEqual(CourseProgress.objects.get(user=students[0]).completed_contents, 20)
+        self.assertEqual(CourseProgress.objects.get(user=students[2]).completed_contents, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            course.delete()
+        self.assertFalse(CourseProgress.objects.exists())
+
+
+class CourseAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(email='owner@example.com', password='x')
+        self.owner.user_permissions.add(Permission.objects.get(codename='view_course'))
+        subject = Subject.objects.create(title='Subject', slug='subject')
+        self.course = Course.objects.create(owner=self.owner, subject=subject, title='Course', slug='course',
+                                            overview='o')
+        self.other = Course.objects.create(owner=self.owner, subject=subject, title='Other', slug='other',
+                                           overview='o')
+        self.students = [User.objects.create_user(email=f'student{i}@example.com', password='x') for i in range(3)]
+        self.today = timezone.localdate()
+
+    @mock.patch.object(MessageBuffer, '_start')
+    def test_activity_is_counted_per_day(self, start):
+        self.course.students.add(*self.students)
+        self.course.students.add(self.students[0])
+        self.students[0].courses_joined.add(self.other)
+        list(bulk_enroll(self.course, ['new1@example.com', 'new2@example.com', 'student1@example.com']))
+        module = Module.objects.create(course=self.course, title='Module')
+        for _ in range(3):
+            Content.objects.create(module=module, item=Text.objects.create(owner=self.owner, title='t', content='x'))
+        messages = MessageBuffer()
+        chat_group = ChatGroup(id=chat_group_id(self.course.id), group_name=f'chat_{self.course.id}')
+        for i in range(5):
+            messages.add(self.students[0], chat_group, f'hello {i}')
+        messages.flush()
+
+        row = CourseDailyStats.objects.get(course=self.course, day=self.today)
+        self.assertEqual((row.new_enrollments, row.messages, row.contents_added), (5, 5, 3))
+        self.assertEqual(CourseDailyStats.objects.get(course=self.other).new_enrollments, 1)
+
+    def test_owner_report(self):
+        self.course.students.add(*self.students)
+        earlier = self.today - datetime.timedelta(days=3)
+        add_daily({(self.course.id, earlier): {'messages': 7}})
+        add_daily({(self.course.id, earlier): {'messages': 1}})
+        self.client.login(email='owner@example.com', password='x')
+        url = f'/course/{self.course.id}/analytics/'
+        response = self.client.get(url, {'days': 7})
+        self.assertContains(response, '<td class="text-end">8</td>')
+        self.assertEqual(len(self.client.get(url, {'days': 7, 'format': 'csv'}).content.decode().splitlines()), 8)
+        days = self.client.get(url, {'days': 'abc', 'format': 'json'}).json()['days']
+        self.assertEqual(len(days), 30)
+        self.assertEqual(days[-1], {'day': self.today.isoformat(), 'new_enrollments': 3, 'messages': 0,
+                                    'contents_added': 0})
+        self.assertContains(self.client.get('/course/mine/'), 'analytics')
+
+        self.client.login(email='student0@example.com', password='x')
+        self.assertEqual(self.client.get(url).status_code, 403)
@@ -8,6 +8,7 @@ urlpatterns = [
     path('<pk>/edit/', views.CourseUpdateMixin.as_view(), name='course_edit'),
     path('<pk>/delete/', views.CourseDeleteView.as_view(), name='course_delete'),
     path('<pk>/module/', views.CourseModuleUpdateView.as_view(), name='course_module_update'),
+    path('<pk>/analytics/', views.CourseAnalyticsView.as_view(), name='course_analytics'),
     path('module/<int:module_id>/content/<model_name>/create/', views.ContentCreateUpdateView.as_view(),
          name='module_content_create'),
     path('module/<int:module_id>/content/<model_name>/<id>/', views.ContentCreateUpdateView.as_view(),
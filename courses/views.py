@@ -1,20 +1,30 @@
+import csv
 import logging
 
 from braces.views import CsrfExemptMixin, JsonRequestResponseMixin
 from django.apps import apps
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from django.core.cache import cache
-from django.db.models import Count
+from django.db.models import Prefetch
 from django.forms.models import modelform_factory
+from django.http import Http404, HttpResponse, JsonResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
+from django.utils.crypto import salted_hmac
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic.base import TemplateResponseMixin, View
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.views.generic.list import ListView
 
+from courses import catalog
+from courses.analytics import STAT_FIELDS, daily_stats
+from courses.enrollment import is_enrolled
 from courses.forms import ModuleFormset
-from courses.models import Course, Module, Content, Subject
+from courses.fragments import bump_course_version, bump_module_version, course_etag
+from courses.models import Course, Module, Content
+from courses.reorder import ReorderError, bulk_reorder
 from students.forms import CourseEnrollForm
 
 
@@ -63,6 +73,44 @@ class CourseDeleteView(OwnerCourseMixin, DeleteView):
     permission_required = 'courses.delete_course'
 
 
+class CourseAnalyticsView(OwnerCourseMixin, DetailView):
+    """Daily enrollments, chat messages and added contents of a course, read from its rollups only."""
+    template_name = 'courses/manage/course/analytics.html'
+    permission_required = 'courses.view_course'
+    context_object_name = 'course'
+    periods = (7, 30, 90, 365)
+
+    def get_days(self):
+        try:
+            days = int(self.request.GET.get('days', 30))
+        except ValueError:
+            days = 30
+        return max(1, min(days, self.periods[-1]))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        stats = daily_stats(self.object.id, self.get_days())
+        context['days'] = len(stats)
+        context['periods'] = self.periods
+        context['stats'] = stats
+        context['totals'] = {field: sum(row[field] for row in stats) for field in STAT_FIELDS}
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        export = self.request.GET.get('format')
+        if export == 'json':
+            return JsonResponse({'course': self.object.id, 'days': context['stats']})
+        if export == 'csv':
+            response = HttpResponse(content_type='text/csv')
+            response['Content-Disposition'] = f'attachment; filename="{self.object.slug}-analytics.csv"'
+            writer = csv.writer(response)
+            writer.writerow(['day', *STAT_FIELDS])
+            for row in context['stats']:
+                writer.writerow([row['day'].isoformat(), *(row[field] for field in STAT_FIELDS)])
+            return response
+        return super().render_to_response(context, **response_kwargs)
+
+
 class CourseModuleUpdateView(TemplateResponseMixin, View):
     template_name = 'courses/manage/course/formset.html'
     course = None
@@ -121,12 +169,9 @@ class ContentCreateUpdateView(TemplateResponseMixin, View):
             obj = form.save(commit=False)
             obj.owner = request.user
             obj.save()
-
             if not kwargs.get('id'):
                 Content.objects.create(module=self.module, item=obj)
-                return redirect('module_content_list', self.module.id)
-            else:
-                return redirect('module_content_list', self.module.id)
+            return redirect('module_content_list', self.module.id)
 
 
         return self.render_to_response(context={'form': form, 'object': self.content_obj})
@@ -158,14 +203,21 @@ class ModuleContentListView(ListView):
     context_object_name = 'module'
 
     def get_queryset(self):
-        return get_object_or_404(Module, id=self.kwargs['module_id'], course__owner=self.request.user)
+        modules = Module.objects.select_related('course').prefetch_related(
+            Prefetch('contents', queryset=Content.objects.with_items()))
+        return get_object_or_404(modules, id=self.kwargs['module_id'], course__owner=self.request.user)
 
 
 class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
 
     def post(self, request):
-        for module_id, order in self.request_json.items():
-            Module.objects.filter(id=module_id, course__owner=request.user).update(order=order)
+        try:
+            course_id = bulk_reorder(Module.objects.filter(course__owner=request.user), self.request_json,
+                                     'course_id')
+        except ReorderError as e:
+            return self.render_bad_request_response({'error': str(e)})
+
+        bump_course_version(course_id)
 
         return self.render_json_response({'saved': 'OK'})
 
@@ -173,9 +225,14 @@ class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
 class ContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
 
     def post(self, request):
-        for content_id, order in self.request_json.items():
-            Content.objects.filter(id=content_id, module__course__owner=request.user).update(order=order)
-
+        try:
+            module_id = bulk_reorder(Content.objects.filter(module__course__owner=request.user),
+                                     self.request_json, 'module_id')
+        except ReorderError as e:
+            return self.render_bad_request_response({'error': str(e)})
+
+        bump_module_version(module_id)
+        bump_course_version(Module.objects.values_list('course_id', flat=True).get(id=module_id))
         return self.render_json_response({'saved': 'OK'})
 
 
@@ -184,33 +241,33 @@ class CourseListView(TemplateResponseMixin, View):
     model = Course
 
     def get(self, request, subject=None):
-        subjects = cache.get('all_subjects')
-        if not subjects:
-            subjects = Subject.objects.annotate(total_courses=Count('courses'))
-            cache.set('all_subjects', subjects)
-            logger.info('Subjects all_subjects added to cache')
-
-        all_courses = Course.objects.annotate(total_modules=Count('modules'))
+        subjects = catalog.get_subjects()
 
         if subject:
-            subject = get_object_or_404(Subject, slug=subject)
-
-            key = f"subject_{subject.id}_courses"
-            courses = cache.get(key)
-            if not courses:
-                courses = all_courses.filter(subject=subject).order_by('-created')
-                cache.set(key, courses)
-                logger.info(f"Filtered courses {key} added to cache")
+            subject = next((s for s in subjects if s['slug'] == subject), None)
+            if subject is None:
+                raise Http404('No Subject matches the given query.')
+            courses = catalog.get_courses(subject_id=subject['id'])
         else:
-            courses = cache.get('all_courses')
-            if not courses:
-                courses = all_courses
-                cache.set('all_courses', courses)
-                logger.info("Courses all_courses added to cache")
+            courses = catalog.get_courses()
 
         return self.render_to_response({'subjects': subjects, 'courses': courses, 'subject': subject})
 
 
+def course_detail_etag(request, slug):
+    course_id = Course.objects.filter(slug=slug).values_list('id', flat=True).first()
+    if course_id is None:
+        return None
+    enrolled = is_enrolled(request.user, course_id)
+    if enrolled:
+        return course_etag(course_id, request.user.id, 1)
+    # the page carries the enroll form, so it must not outlive the CSRF secret it was rendered for
+    get_token(request)
+    csrf = salted_hmac('course_detail_etag', request.META['CSRF_COOKIE']).hexdigest()[:16]
+    return course_etag(course_id, request.user.id, 0, csrf)
+
+
+@method_decorator(condition(etag_func=course_detail_etag), name='get')
 class CourseDetailView(DetailView):
     model = Course
     template_name = 'courses/course/detail.html'
@@ -219,4 +276,5 @@ class CourseDetailView(DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['enroll_form'] = CourseEnrollForm(initial={'course': self.object})
+        context['enrolled'] = is_enrolled(self.request.user, self.object.id)
         return context
@@ -73,6 +73,40 @@ TEMPLATES = [
 WSGI_APPLICATION = 'educa.wsgi.application'
 # channels
 ASGI_APPLICATION = 'educa.asgi.application'
+# 'async' or 'sync', see chat.routing
+CHAT_CONSUMER = 'async'
+# threads (and database connections) used by the async chat consumer
+CHAT_DB_WORKERS = 4
+# chat messages are written in batches of up to CHAT_FLUSH_SIZE, at least every CHAT_FLUSH_INTERVAL seconds
+CHAT_FLUSH_SIZE = 100
+CHAT_FLUSH_INTERVAL = 0.5
+# messages kept for retrying while the database can't be written, the oldest are dropped beyond it
+CHAT_MAX_PENDING = 10000
+# newest messages kept in memory per room, for the CHAT_RECENT_ROOMS most recently used rooms. Rooms
+# without a socket in this process are read from the database again after CHAT_RECENT_TTL seconds
+CHAT_RECENT_MESSAGES = 50
+CHAT_RECENT_ROOMS = 1000
+CHAT_RECENT_TTL = 5
+# rooms sending CHAT_BATCH_RATE or more messages a second are fanned out in batches every
+# CHAT_BATCH_TICK seconds, 0 sends every message on its own
+CHAT_BATCH_TICK = 0.05
+CHAT_BATCH_RATE = 20
+# chat clients send a heartbeat every CHAT_HEARTBEAT_INTERVAL seconds, typing shows for CHAT_TYPING_TIMEOUT
+# seconds, and online/typing counts go out at most every CHAT_PRESENCE_INTERVAL seconds per room
+CHAT_HEARTBEAT_INTERVAL = 20
+CHAT_TYPING_TIMEOUT = 5
+CHAT_PRESENCE_INTERVAL = 2
+# messages older than CHAT_RETENTION_DAYS (or the room's retention_days) are moved to gzip JSON lines
+# segments of CHAT_ARCHIVE_SEGMENT_SIZE messages under CHAT_ARCHIVE_ROOT by the archive_chat command
+CHAT_RETENTION_DAYS = 90
+CHAT_ARCHIVE_SEGMENT_SIZE = 10000
+CHAT_ARCHIVE_ROOT = BASE_DIR / 'chat_archive'
+# content completions are written in batches of up to PROGRESS_FLUSH_SIZE, at least every
+# PROGRESS_FLUSH_INTERVAL seconds, and rolled up into per-course progress as they are
+PROGRESS_FLUSH_SIZE = 500
+PROGRESS_FLUSH_INTERVAL = 2.0
+# sockets authenticate through the session on every connect, so sessions are read from the cache
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 # CHANNEL_LAYERS = {
 #     'default': {
 #         'BACKEND': 'channels_redis.core.RedisChannelLayer',
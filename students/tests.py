@@ -1,3 +1,118 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+from courses.enrollment import course_member_ids, enrolled_course_ids
+from courses.models import Content, Course, Module, Subject, Text
+from courses.progress import progress_buffer
+from courses.tests import basic_auth
+
+
+class StudentTestCase(TestCase):
+    """Student pages record progress from a background thread, these tests leave it out."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(progress_buffer, 'record')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = User.objects.create_user(email='owner@example.com', password='x')
+        self.student = User.objects.create_user(email='student@example.com', password='x')
+        self.subject = Subject.objects.create(title='Subject', slug='subject')
+        self.course = Course.objects.create(owner=self.owner, subject=self.subject, title='Course', slug='course',
+                                            overview='o')
+        self.client.login(email='student@example.com', password='x')
+
+
+class EnrollmentCacheTests(StudentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.module = Module.objects.create(course=self.course, title='Module', description='d')
+        self.other = Course.objects.create(owner=self.owner, subject=self.subject, title='Other', slug='other',
+                                           overview='o')
+
+    def enrollment_queries(self, captured):
+        return [query['sql'] for query in captured if 'courses_course_students' in query['sql']]
+
+    def test_pages_read_enrollment_from_the_cache(self):
+        self.assertEqual(self.client.get(f'/students/course/{self.course.id}/').status_code, 404)
+        self.assertContains(self.client.get('/course/course/'), 'Enroll Now')
+        self.course.students.add(self.student)
+        urls = ['/students/courses/', f'/students/course/{self.course.id}/',
+                f'/students/course/{self.course.id}/{self.module.id}/', '/course/course/']
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+        with CaptureQueriesContext(connection) as queries:
+            for url in urls:
+                self.client.get(url)
+            response = self.client.get(f'/api/v1/courses/{self.course.id}/contents/',
+                                       **basic_auth('student@example.com'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.enrollment_queries(queries.captured_queries), [])
+        self.assertNotContains(self.client.get('/course/course/'), 'Enroll Now')
+        self.assertEqual(self.client.get(f'/api/v1/courses/{self.other.id}/contents/',
+                                         **basic_auth('student@example.com')).status_code, 403)
+
+    def test_both_sides_of_the_relation_invalidate(self):
+        self.course.students.add(self.student)
+        self.assertEqual(enrolled_course_ids(self.student), {self.course.id})
+        self.assertEqual(course_member_ids(self.course.id), {self.student.id})
+
+        self.student.courses_joined.add(self.other)
+        self.assertEqual(enrolled_course_ids(self.student), {self.course.id, self.other.id})
+        self.assertEqual(course_member_ids(self.other.id), {self.student.id})
+        self.course.students.clear()
+        self.assertEqual(enrolled_course_ids(self.student), {self.other.id})
+        self.assertEqual(course_member_ids(self.course.id), set())
+        self.student.courses_joined.remove(self.other)
+        self.assertEqual(enrolled_course_ids(self.student), set())
+        self.assertEqual(course_member_ids(self.other.id), set())
+        self.assertEqual(self.client.get(f'/students/course/{self.course.id}/').status_code, 404)
+
+
+class CourseOutlineTests(StudentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.modules = [Module.objects.create(course=self.course, title=f'Module {i}', description='d')
+                        for i in range(3)]
+        for i in range(4):
+            Content.objects.create(module=self.modules[1],
+                                   item=Text.objects.create(owner=self.owner, title=f'Text {i}', content=f'body{i}'))
+        self.course.students.add(self.student)
+        self.url = f'/students/course/{self.course.id}/{self.modules[1].id}/'
+
+    def test_module_pages_share_the_cached_outline(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'body3')
+        self.assertContains(response, 'Module 2')
+        self.assertContains(response, '>4</span>')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(f'/students/course/{self.course.id}/{self.modules[2].id}/').status_code,
+                             200)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'FROM "courses_module"' in query['sql'] or 'FROM "courses_course"' in query['sql']])
+
+    def test_missing_courses_and_modules(self):
+        self.assertEqual(self.client.get(f'/students/course/{self.course.id}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/students/course/{self.course.id}/99999/').status_code, 404)
+        self.assertEqual(self.client.get('/students/course/99999/').status_code, 404)
+        empty = Course.objects.create(owner=self.owner, subject=self.subject, title='Empty', slug='empty',
+                                      overview='o')
+        empty.students.add(self.student)
+        self.assertContains(self.client.get(f'/students/course/{empty.id}/'), 'No modules yet')
+        self.client.login(email='owner@example.com', password='x')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
 
-# Create your tests here.
+    def test_edits_invalidate_the_outline(self):
+        self.client.get(self.url)
+        self.modules[2].title = 'Renamed'
+        self.modules[2].save()
+        self.assertContains(self.client.get(self.url), 'Renamed')
+        Content.objects.create(module=self.modules[2],
+                               item=Text.objects.create(owner=self.owner, title='New', content='new'))
+        self.assertContains(self.client.get(self.url), '>1</span>')
@@ -1,14 +1,20 @@
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView
 from django.views.generic.edit import FormView
 from django.views.generic.list import ListView
-from django.core.cache import cache
 
-from courses.models import Course
+from courses.enrollment import enrolled_course_ids, is_enrolled
+from courses.fragments import course_etag, get_course_modified, get_module_version
+from courses.models import Content, Course
+from courses.outline import find_module, get_course_outline
+from courses.progress import course_progress, record_module_view
 from students.forms import CourseEnrollForm
 import logging
 
@@ -52,32 +58,55 @@ class StudentCourseListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         qs = super().get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        return qs.filter(id__in=enrolled_course_ids(self.request.user))
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        courses = list(context['courses'])
+        progress = course_progress(self.request.user, courses)
+        for course in courses:
+            course.progress = progress[course.id]
+        context['courses'] = courses
+        return context
+
+
+def student_course_etag(request, pk, module_id=None):
+    if not is_enrolled(request.user, pk):
+        return None
+    return course_etag(pk, request.user.id, module_id)
+
+
+def student_course_last_modified(request, pk, module_id=None):
+    return get_course_modified(pk)
 
+
+@method_decorator(condition(etag_func=student_course_etag, last_modified_func=student_course_last_modified),
+                  name='get')
 class StudentCourseDetailView(LoginRequiredMixin, DetailView):
     model = Course
     template_name = 'students/course/detail.html'
     context_object_name = 'course'
 
-    def get_queryset(self):
-        qs = super().get_queryset()
-        return qs.filter(students__in=[self.request.user])
+    def get_object(self, queryset=None):
+        """The cached course outline instead of a Course row."""
+        outline = None
+        if is_enrolled(self.request.user, self.kwargs['pk']):
+            outline = get_course_outline(self.kwargs['pk'])
+        if outline is None:
+            raise Http404('No course found matching the query')
+        return outline
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-
-        course = self.get_object()
-
-        if 'module_id' in self.kwargs:
-            key = f"enrolled_module_{course.id}_{self.kwargs['module_id']}"
-            module = cache.get(key)
-            if not module:
-                module = course.modules.get(id=self.kwargs['module_id'])
-                cache.set(key, module)
-                logger.debug(f"Added course module {key} to cache")
-            context['module'] = module
-        else:
-            context['module'] = course.modules.all()[0]
-
+        module = find_module(self.object, self.kwargs.get('module_id'))
+        if module is None and 'module_id' in self.kwargs:
+            raise Http404('No module found matching the query')
+
+        context['module'] = module
+        if module is None:
+            context['contents'] = Content.objects.none()
+            return context
+        context['contents'] = Content.objects.filter(module_id=module['id']).with_items()
+        context['module_version'] = get_module_version(module['id'])
+        record_module_view(self.request.user, self.object['id'], module, context['module_version'])
         return context